@@ -4,6 +4,10 @@ class SchellingAgent(Agent):
     ## Initiate agent instance, inherit model trait from parent class
     def __init__(self, model, agent_type, lower_threshold, upper_threshold):
         super().__init__(model)
+        self.reset(agent_type, lower_threshold, upper_threshold)
+
+    ## Set agent state; also used when the model recycles the agent for a new run
+    def reset(self, agent_type, lower_threshold, upper_threshold):
         ## Set agent type
         self.type = agent_type
         ## Set personal tolerance threshold
@@ -13,8 +17,8 @@ class SchellingAgent(Agent):
     ## Define basic decision rule
     def move(self):
         ## Get list of neighbors within range of sight
-        neighbors = self.model.grid.get_neighbors(
-            self.pos, moore = True, radius = self.model.radius, include_center = False)
+        neighbors = list(self.model.grid.iter_cell_list_contents(
+            self.model.neighbour_cells.cells(self.pos)))
         ## Count neighbors of same type as self
         similar_neighbors = len([n for n in neighbors if n.type == self.type])
         ## If an agent has any neighbors (to avoid division by zero), calculate share of neighbors of same type
@@ -30,19 +34,21 @@ class SchellingAgent(Agent):
             return
 
         # Agent is unhappy: attempt to move
-        empties = list(self.model.grid.empties)
-        if not empties:
+        pool = self.model.grid.empty_pool
+        if not len(pool):
             return
-        # Try a random empty spot
-        new_pos = self.random.choice(empties)
-        new_neighbors = self.model.grid.get_neighbors(
-            new_pos, moore=True, radius=self.model.radius, include_center=False
-        )
-        same_new = len([n for n in new_neighbors if n.type == self.type])
-        total_new = len(new_neighbors)
-        new_share = same_new / total_new if total_new > 0 else 0
+        # Try up to relocation_candidates distinct random empty spots, taking the first acceptable one
+        k = self.model.relocation_candidates
+        cells = [pool.sample(self.random)] if k == 1 else pool.sample_k(k, self.random)
+        for cell in cells:
+            new_pos = pool.to_pos(cell)
+            new_neighbors = list(self.model.grid.iter_cell_list_contents(
+                self.model.neighbour_cells.cells(new_pos)))
+            same_new = len([n for n in new_neighbors if n.type == self.type])
+            total_new = len(new_neighbors)
+            new_share = same_new / total_new if total_new > 0 else 0
 
-        # Apply Decision Rule: move only if new_share within tolerance range
-        if self.lower_threshold <= new_share <= self.upper_threshold:
-            self.model.grid.move_agent(self, new_pos)
- 
+            # Apply Decision Rule: move only if new_share within tolerance range
+            if self.lower_threshold <= new_share <= self.upper_threshold:
+                self.model.grid.move_agent(self, new_pos)
+                return
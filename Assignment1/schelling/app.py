@@ -1,11 +1,20 @@
+import os
 import solara
 from model import SchellingModel
+from recording import ReplayModel, Recording
+from raster import categorical, make_raster_component
 from mesa.visualization import (  
     SolaraViz,
     make_space_component,
     make_plot_component,
 )
 
+## The grid is drawn as one raster image from the model's cell arrays;
+## SPACE=markers draws one matplotlib marker per agent instead.
+## RENDER_INTERVAL=n advances n steps per redraw (also a UI slider).
+SPACE = os.environ.get("SPACE", "raster")
+RENDER_INTERVAL = int(os.environ.get("RENDER_INTERVAL", 1))
+
 ## Define agent portrayal: color, shape, and size
 
 def agent_portrayal(agent):
@@ -15,6 +24,10 @@ def agent_portrayal(agent):
         "size": 40,
     }
 
+## Same colors for the raster view: type 1 blue, type 0 red
+def grid_colors(layers):
+    return categorical(layers["type"], {1: (0.12, 0.47, 0.71), 0: (0.84, 0.15, 0.16)})
+
 ## Enumerate variable parameters in model: seed, grid dimensions, population density, agent preferences, vision, and relative size of groups.
 model_params = {
     "seed": {
@@ -87,12 +100,50 @@ model_params = {
         "min": 0,
         "max": 1,
         "step": 0.01,
-    }
+    },
+    "relocation_candidates": {
+        "type": "SliderInt",
+        "value": 1,
+        "label": "Empty Sites Tried per Move",
+        "min": 1,
+        "max": 10,
+        "step": 1,
+    },
+    ## "array" runs the vectorized engine; it has no Mesa agents, so with
+    ## SPACE=markers only the happiness plot updates for it
+    "engine": {
+        "type": "Select",
+        "value": "agent",
+        "values": ["agent", "array"],
+        "label": "Engine",
+    },
 
 }
 schelling_model = SchellingModel()
+
+## REPLAY=<dir> plays back a run saved by recording.py instead of simulating;
+## the start frame slider scrubs through it
+replay = os.environ.get("REPLAY")
+if replay:
+    frames = len(Recording(replay))
+    model_params = {
+        "path": replay,
+        "frame": {
+            "type": "SliderInt",
+            "value": 0,
+            "label": "Start Frame",
+            "min": 0,
+            "max": max(frames - 1, 0),
+            "step": 1,
+        },
+        "agents": SPACE != "raster",
+    }
+    schelling_model = ReplayModel(replay, agents=SPACE != "raster")
 HappyPlot = make_plot_component({"share_happy": "tab:green"})
-SpaceGraph = make_space_component(agent_portrayal, draw_grid=False)
+if SPACE == "raster":
+    SpaceGraph = make_raster_component(grid_colors)
+else:
+    SpaceGraph = make_space_component(agent_portrayal, draw_grid=False)
 
 ## Instantiate
 page = SolaraViz(
@@ -100,6 +151,7 @@ page = SolaraViz(
     components=[SpaceGraph, HappyPlot],
     model_params=model_params,
     name="Schelling Segregation Model with Heterogeneity",
+    render_interval=RENDER_INTERVAL,
 )
 
 page
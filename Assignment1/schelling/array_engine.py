@@ -0,0 +1,136 @@
+import numpy as np
+from empty_pool import EmptyCellPool
+
+EMPTY = -1
+
+def box_sum(a, radius):
+    ## Sum of `a` over the (2r+1)x(2r+1) torus window around every cell
+    ## (center included), using cumulative sums along each axis
+    p = np.pad(a, radius, mode="wrap")
+    w = 2 * radius + 1
+    c = np.cumsum(p, axis=0)
+    c = np.concatenate([np.zeros_like(c[:1]), c], axis=0)
+    c = c[w:] - c[:-w]
+    c = np.cumsum(c, axis=1)
+    c = np.concatenate([np.zeros_like(c[:, :1]), c], axis=1)
+    return c[:, w:] - c[:, :-w]
+
+def neighbour_count(a, radius):
+    ## Sum of `a` over each cell's Moore neighbourhood on a torus, center
+    ## excluded, counting every distinct cell once like SingleGrid.get_neighbors
+    width, height = a.shape
+    if 2 * radius + 1 <= min(width, height):
+        return box_sum(a, radius) - a
+    ## The window wraps onto itself: sum the distinct offsets instead
+    dxs = {dx % width for dx in range(-radius, radius + 1)}
+    dys = {dy % height for dy in range(-radius, radius + 1)}
+    total = np.zeros_like(a)
+    for dx in dxs:
+        for dy in dys:
+            if dx or dy:
+                total += np.roll(a, (-dx, -dy), axis=(0, 1))
+    return total
+
+def settle(candidates, ok):
+    ## Target cell per row of `candidates` (-1: stay) when rows take turns in
+    ## order, each taking its first acceptable (`ok`) candidate that no
+    ## earlier row took. Worked out in rounds: a row's pick is final once it
+    ## is the earliest undecided row that still has that cell open.
+    target = np.full(len(candidates), -1, dtype=np.int64)
+    open_ = ok.copy()
+    pending = np.flatnonzero(open_.any(axis=1))
+    while len(pending):
+        avail = open_[pending]
+        cells = candidates[pending]
+        ## earliest pending row with each open cell (rows are in order)
+        claimed, first = np.unique(cells[avail], return_index=True)
+        owner = np.repeat(pending, avail.sum(axis=1))[first]
+        pick = cells[np.arange(len(pending)), np.argmax(avail, axis=1)]
+        won = owner[np.searchsorted(claimed, pick)] == pending
+        target[pending[won]] = pick[won]
+        open_[pending[won]] = False
+        open_[pending] &= ~np.isin(cells, pick[won])
+        pending = pending[open_[pending].any(axis=1)]
+    return target
+
+class ArrayEngine:
+    ## Array-backed Schelling dynamics: a type grid plus per-agent arrays, with
+    ## happiness for all agents evaluated at once from neighbour counts.
+    def __init__(self, model, population):
+        self.model = model
+        self.rng = model.rng
+        self.width = model.width
+        self.height = model.height
+        self.radius = model.radius
+
+        ## population: list of (pos, agent_type, lower_threshold, upper_threshold)
+        self.x = np.array([p[0] for p, _, _, _ in population], dtype=np.int64)
+        self.y = np.array([p[1] for p, _, _, _ in population], dtype=np.int64)
+        self.type = np.array([t for _, t, _, _ in population], dtype=np.int8)
+        self.lower = np.array([lo for _, _, lo, _ in population], dtype=float)
+        self.upper = np.array([up for _, _, _, up in population], dtype=float)
+
+        ## Agent id per cell, EMPTY where nobody lives
+        self.cell_agent = np.full((self.width, self.height), EMPTY, dtype=np.int64)
+        self.cell_agent[self.x, self.y] = np.arange(len(self.x))
+        self.empties = EmptyCellPool(
+            self.width, self.height, np.flatnonzero(self.cell_agent.ravel() == EMPTY))
+
+    def __len__(self):
+        return len(self.x)
+
+    def type_grid(self):
+        ## Agent type per cell, EMPTY for empty cells
+        occupied = self.cell_agent != EMPTY
+        return np.where(occupied, self.type[self.cell_agent], EMPTY)
+
+    def neighbour_counts(self):
+        ## Occupied and type-1 neighbours around every cell
+        types = self.type_grid()
+        n_occupied = neighbour_count((types != EMPTY).astype(np.int64), self.radius)
+        n_type_one = neighbour_count((types == 1).astype(np.int64), self.radius)
+        return n_occupied, n_type_one
+
+    def share_alike(self, agents, x, y, n_occupied, n_type_one):
+        total = n_occupied[x, y]
+        same = np.where(self.type[agents] == 1, n_type_one[x, y], total - n_type_one[x, y])
+        return np.where(total > 0, same / np.maximum(total, 1), 0.0)
+
+    def step(self):
+        n_occupied, n_type_one = self.neighbour_counts()
+        agents = np.arange(len(self.x))
+
+        ## Decision Rule for everyone at once
+        share = self.share_alike(agents, self.x, self.y, n_occupied, n_type_one)
+        happy = (self.lower <= share) & (share <= self.upper)
+        self.model.happy += int(happy.sum())
+
+        ## Every unhappy agent, in random order, draws its own k distinct
+        ## cells from those empty at the start of the step (several agents
+        ## may draw the same cell) and wants the first acceptable one
+        movers = self.rng.permutation(np.flatnonzero(~happy))
+        k = self.model.relocation_candidates
+        if len(movers) == 0 or len(self.empties) == 0:
+            return
+        candidates = self.empties.sample_rows(len(movers), k, self.rng)
+        cx, cy = np.divmod(candidates, self.height)
+        new_share = self.share_alike(movers[:, None], cx, cy, n_occupied, n_type_one)
+        ok = (self.lower[movers, None] <= new_share) & (new_share <= self.upper[movers, None])
+        ## A cell wanted by several agents goes to the first of them in the
+        ## order; the others fall back to their next acceptable candidate,
+        ## or stay put when none is left
+        targets = settle(candidates, ok)
+        moved = targets >= 0
+        movers, targets = movers[moved], targets[moved]
+        tx, ty = np.divmod(targets, self.height)
+
+        ## Targets are distinct empty cells, so all moves apply together
+        vacated = self.x[movers] * self.height + self.y[movers]
+        self.cell_agent[self.x[movers], self.y[movers]] = EMPTY
+        self.cell_agent[tx, ty] = movers
+        self.x[movers] = tx
+        self.y[movers] = ty
+        for cell in targets:
+            self.empties.remove(cell)
+        for cell in vacated:
+            self.empties.add(cell)
@@ -0,0 +1,107 @@
+import numpy as np
+from mesa.space import SingleGrid
+
+class EmptyCellPool:
+    ## Set of empty cells with O(1) add, remove and uniform sampling.
+    ## Cells are stored densely in `cells[:size]` (swap-remove on delete) and
+    ## `index[cell]` gives each cell's slot, or -1 when the cell is occupied.
+    ## Cells are flat indices x * height + y.
+    def __init__(self, width, height, empty_cells=()):
+        self.width = width
+        self.height = height
+        self.cells = np.empty(width * height, dtype=np.int64)
+        self.index = np.full(width * height, -1, dtype=np.int64)
+        ## empty_cells: distinct flat cells, filled in bulk
+        empty_cells = np.asarray(empty_cells, dtype=np.int64)
+        self.size = len(empty_cells)
+        self.cells[:self.size] = empty_cells
+        self.index[empty_cells] = np.arange(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, cell):
+        return self.index[cell] >= 0
+
+    def add(self, cell):
+        if self.index[cell] >= 0:
+            return
+        self.cells[self.size] = cell
+        self.index[cell] = self.size
+        self.size += 1
+
+    def remove(self, cell):
+        slot = self.index[cell]
+        if slot < 0:
+            return
+        ## Move the last cell into the freed slot
+        last = self.cells[self.size - 1]
+        self.cells[slot] = last
+        self.index[last] = slot
+        self.index[cell] = -1
+        self.size -= 1
+
+    def sample(self, rng):
+        ## One uniformly random empty cell; rng is a random.Random or numpy Generator
+        if isinstance(rng, np.random.Generator):
+            return int(self.cells[rng.integers(self.size)])
+        return int(self.cells[rng.randrange(self.size)])
+
+    def sample_k(self, k, rng):
+        ## k distinct empty cells (fewer if the pool is smaller)
+        k = min(k, self.size)
+        if isinstance(rng, np.random.Generator):
+            return self.cells[rng.choice(self.size, size=k, replace=False)]
+        return self.cells[rng.sample(range(self.size), k)]
+
+    def sample_rows(self, n, k, rng):
+        ## n independent draws of k distinct empty cells each, as an (n, k)
+        ## array; different rows may share cells. rng is a numpy Generator
+        k = min(k, self.size)
+        if 2 * k > self.size:
+            ## most of the pool per row: shuffle all of it
+            slots = rng.permuted(np.tile(np.arange(self.size), (n, 1)), axis=1)[:, :k]
+            return self.cells[slots]
+        slots = rng.integers(self.size, size=(n, k))
+        while k > 1:
+            ## redraw every repeat within a row until all rows are distinct
+            order = np.argsort(slots, axis=1, kind="stable")
+            ranked = np.take_along_axis(slots, order, axis=1)
+            repeat = ranked[:, 1:] == ranked[:, :-1]
+            if not repeat.any():
+                break
+            rows, cols = np.nonzero(repeat)
+            slots[rows, order[rows, cols + 1]] = rng.integers(self.size, size=len(rows))
+        return self.cells[slots]
+
+    def to_pos(self, cell):
+        return divmod(int(cell), self.height)
+
+    def to_cell(self, pos):
+        return pos[0] * self.height + pos[1]
+
+class PooledSingleGrid(SingleGrid):
+    ## SingleGrid that keeps an EmptyCellPool in sync on every place_agent and
+    ## remove_agent (and therefore every move_agent), so relocating agents can
+    ## sample empty cells without copying grid.empties into a list
+    def __init__(self, width, height, torus):
+        super().__init__(width, height, torus)
+        self.empty_pool = EmptyCellPool(width, height, range(width * height))
+
+    def place_agent(self, agent, pos):
+        super().place_agent(agent, pos)
+        self.empty_pool.remove(self.empty_pool.to_cell(pos))
+
+    def remove_agent(self, agent):
+        pos = agent.pos
+        super().remove_agent(agent)
+        if pos is not None:
+            self.empty_pool.add(self.empty_pool.to_cell(pos))
+
+    def clear(self, agents):
+        ## Remove `agents` and rebuild the pool in its initial order, so a
+        ## cleared grid samples empty cells exactly like a new one
+        for agent in agents:
+            if agent.pos is not None:
+                super().remove_agent(agent)
+        self.empty_pool = EmptyCellPool(self.width, self.height, range(self.width * self.height))
@@ -1,7 +1,19 @@
+import sys
+import numpy as np
 from mesa import Model
-from mesa.space import SingleGrid
 from agents import SchellingAgent
 from mesa.datacollection import DataCollector
+from profiling import StepProfiler, clock
+from array_engine import ArrayEngine
+from empty_pool import PooledSingleGrid
+from neighbourhood import neighbourhood_table
+
+ENGINES = ("agent", "array")
+
+## Constructor parameters reset() accepts besides the seed
+PARAMS = ("width", "height", "density", "group_one_share", "tolerance_mean",
+          "tolerance_std", "tolerance_upper", "radius", "instrument", "engine",
+          "relocation_candidates")
 
 class SchellingModel(Model):
     ## Define initiation, requiring all needed parameter inputs
@@ -12,30 +24,79 @@ class SchellingModel(Model):
         tolerance_upper=0.9,
         radius=1,
         seed=None,
+        instrument=False,
+        engine="agent",
+        relocation_candidates=1,
     ):
         super().__init__(seed=seed)
-        self.width = width
-        self.height = height
-        self.density = density
-        self.group_one_share = group_one_share
-        self.radius = radius
-
-        # new parameters
-        self.tolerance_mean = tolerance_mean
-        self.tolerance_std = tolerance_std
-        self.tolerance_upper = tolerance_upper
-        self.grid = SingleGrid(width, height, torus = True)
-        self.happy = 0
+        self.grid = None
+        ## Every SchellingAgent created so far; the first _registered of them
+        ## are registered with the model, and reset() recycles them in order
+        self._agent_pool = []
+        self._registered = 0
         ## Define data collector, to collect happy agents and share of agents currently happy
         self.datacollector = DataCollector(
             model_reporters = {
                 "happy" : "happy",
-                "share_happy" : lambda m : (m.happy / len(m.agents)) * 100
-                if len(m.agents) > 0
+                "share_happy" : lambda m : (m.happy / m.num_agents) * 100
+                if m.num_agents > 0
                 else 0
             }
         )
+        self.reset(width=width, height=height, density=density,
+                   group_one_share=group_one_share, tolerance_mean=tolerance_mean,
+                   tolerance_std=tolerance_std, tolerance_upper=tolerance_upper,
+                   radius=radius, seed=seed, instrument=instrument, engine=engine,
+                   relocation_candidates=relocation_candidates)
+
+    ## Start a new run in place, exactly as a new model with these parameters
+    ## (any not given keep their value) and this seed would; the grid, agents
+    ## and data collector are reused so sweeps can keep one model around
+    def reset(self, seed=None, **params):
+        t_construct = clock()
+        unknown = set(params) - set(PARAMS)
+        if unknown:
+            raise TypeError(f"reset() got unexpected parameters {sorted(unknown)}")
+        engine = params.get("engine", getattr(self, "engine", "agent"))
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, got {engine!r}")
+        for name, value in params.items():
+            setattr(self, name, value)
+        ## "agent": one SchellingAgent per cell; "array": vectorized ArrayEngine
+        self.arrays = None
+        self.running = True
+        self.steps = 0
+        ## Without a seed, draw fresh entropy (and keep it, for reproducibility)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.reset_randomizer(seed)
+        try:
+            self.reset_rng(seed)
+        except TypeError:
+            ## Seeds numpy can't take (e.g. "42" from the app's text field)
+            ## seed it from self.random instead, exactly as Model.__init__ does
+            self.reset_rng(self.random.randint(0, sys.maxsize))
+
+        if self.grid is not None and (self.grid.width, self.grid.height) == (self.width, self.height):
+            self.grid.clear(self._agent_pool[:self._registered])
+        else:
+            for a in self._agent_pool:
+                a.pos = None
+            self.grid = PooledSingleGrid(self.width, self.height, torus = True)
+        ## Precomputed Moore neighbourhood of every cell for the vision radius
+        self.neighbour_cells = neighbourhood_table(self.width, self.height, self.radius, torus = True)
+        self.happy = 0
+        ## Optional per-phase timings and neighbour-query counts; the table is
+        ## shared by every model in the process, so lookups are counted
+        ## through a view that belongs to this model alone
+        self.profiler = StepProfiler() if self.instrument else None
+        if self.profiler is not None:
+            self.neighbour_cells = self.profiler.counting(self.neighbour_cells, "cells")
+        for name in self.datacollector.model_vars:
+            self.datacollector.model_vars[name] = []
+
         ## Place agents randomly around the grid, randomly assigning them to agent types.
+        population = []
         for cont, pos in self.grid.coord_iter():
             if self.random.random() < self.density:
                 agent_type = 1 if self.random.random() < self.group_one_share else 0
@@ -49,20 +110,79 @@ class SchellingModel(Model):
                     upper = self.tolerance_upper
                 else:
                     upper = 1
-                a = SchellingAgent(
-                    model=self,
-                    agent_type=agent_type,
-                    lower_threshold=tolerance,
-                    upper_threshold=upper,
-                )
+                population.append((pos, agent_type, tolerance, upper))
+
+        ## Same draws for both engines, so a seed gives the same initial grid
+        n_agents = 0
+        if engine == "array":
+            self.arrays = ArrayEngine(self, population)
+        else:
+            n_agents = len(population)
+            pool = self._agent_pool
+            for i, (pos, agent_type, tolerance, upper) in enumerate(population):
+                if i < len(pool):
+                    a = pool[i]
+                    a.reset(agent_type, tolerance, upper)
+                    if i >= self._registered:
+                        self.register_agent(a)
+                else:
+                    a = SchellingAgent(
+                        model=self,
+                        agent_type=agent_type,
+                        lower_threshold=tolerance,
+                        upper_threshold=upper,
+                    )
+                    pool.append(a)
                 self.grid.place_agent(a, pos)
+        ## Recycled agents beyond this run's population leave the model
+        for a in self._agent_pool[n_agents:self._registered]:
+            self.deregister_agent(a)
+        self._registered = n_agents
 
         ## Initialize datacollector
         self.datacollector.collect(self)
+        if self.profiler is not None:
+            self.profiler.construct_time = clock() - t_construct
 
     def step(self):
         self.happy = 0
-        self.agents.shuffle_do("move")
-        self.datacollector.collect(self)
+        if self.profiler is not None:
+            self._profiled_step()
+        else:
+            if self.arrays is not None:
+                self.arrays.step()
+            else:
+                self.agents.shuffle_do("move")
+            self.datacollector.collect(self)
         ## Run model until all agents are happy
-        self.running = self.happy < len(self.agents)
+        self.running = self.happy < self.num_agents
+
+    @property
+    def num_agents(self):
+        return len(self.arrays) if self.arrays is not None else len(self.agents)
+
+    ## Per-cell state for recording.Recorder: agent type, -1 for empty cells
+    def grid_layers(self):
+        if self.arrays is not None:
+            return {"type": self.arrays.type_grid().astype(np.int8)}
+        types = np.full((self.width, self.height), -1, dtype=np.int8)
+        for a in self.agents:
+            types[a.pos] = a.type
+        return {"type": types}
+
+    def _profiled_step(self):
+        ## Same work as step(), timed per phase; neighbour lookups are counted
+        ## by the view set up in reset()
+        p = self.profiler
+        t = clock()
+        if self.arrays is not None:
+            self.arrays.step()
+            ## one bulk happiness query per agent
+            p.queries += self.num_agents
+        else:
+            self.agents.shuffle_do("move")
+        p.add("move", clock() - t, self.num_agents)
+        t = clock()
+        self.datacollector.collect(self)
+        p.add("collect", clock() - t)
+        p.end_step()
@@ -0,0 +1,133 @@
+## Invariants of the Schelling model's faster paths, checked against Mesa
+## and the agent engine. Run from this directory:
+##   python -m pytest -q test_schelling.py
+import random
+import numpy as np
+import pytest
+from mesa.space import SingleGrid
+from array_engine import settle
+from empty_pool import EmptyCellPool
+from model import SchellingModel
+from neighbourhood import neighbourhood_table
+
+SMALL = {"width": 15, "height": 12, "density": 0.8}
+
+
+def run_steps(model, steps):
+    for _ in range(steps):
+        if not model.running:
+            break
+        model.step()
+    return model
+
+
+def share_happy(engine, k, seed, steps=10, density=0.95):
+    ## final share of happy agents; at the default density unhappy agents
+    ## far outnumber the empty cells
+    model = SchellingModel(width=30, height=30, density=density, relocation_candidates=k,
+                           engine=engine, seed=seed)
+    return run_steps(model, steps).datacollector.get_model_vars_dataframe()["share_happy"].iloc[-1]
+
+
+@pytest.mark.parametrize("radius", [1, 2, 6])
+def test_neighbourhood_table_matches_mesa(radius):
+    grid = SingleGrid(9, 7, torus=True)
+    table = neighbourhood_table(9, 7, radius, torus=True)
+    for _, pos in grid.coord_iter():
+        assert table.cells(pos) == tuple(grid.get_neighborhood(pos, moore=True, radius=radius))
+
+
+@pytest.mark.parametrize("engine", ["agent", "array"])
+def test_reset_matches_new_model(engine):
+    current = {**SMALL, "engine": engine}
+    model = run_steps(SchellingModel(**current, seed=1), 5)
+    ## parameters not passed to reset() keep their value from the run before
+    for seed, params in (("42", {"radius": 2}),
+                         (7, {"width": 20, "density": 0.5, "relocation_candidates": 3})):
+        current.update(params)
+        model.reset(seed=seed, **params)
+        run_steps(model, 5)
+        fresh = run_steps(SchellingModel(**current, seed=seed), 5)
+        assert model.datacollector.get_model_vars_dataframe().equals(
+            fresh.datacollector.get_model_vars_dataframe())
+        np.testing.assert_array_equal(model.grid_layers()["type"], fresh.grid_layers()["type"])
+
+
+def test_sample_rows_draws_distinct_cells_per_row():
+    rng = np.random.default_rng(0)
+    pool = EmptyCellPool(10, 10, range(0, 100, 10))
+    ## more rows than the pool holds cells, as with many unhappy agents
+    for k in (1, 3, 7, 12):
+        rows = pool.sample_rows(40, k, rng)
+        assert rows.shape == (40, min(k, len(pool)))
+        assert all(len(set(row)) == len(row) for row in rows.tolist())
+        assert set(rows.ravel().tolist()) <= set(range(0, 100, 10))
+
+
+def test_array_engine_moves_like_agent_engine():
+    ## every unhappy agent tries a cell, so the array engine ends up about as
+    ## happy as the agent engine from the same initial grids
+    diff = [share_happy("array", 1, seed) - share_happy("agent", 1, seed) for seed in range(20)]
+    assert abs(np.mean(diff)) < 1.5
+
+
+def check_pool(pool, expected):
+    ## the dense cells and the cell -> slot index describe the same set
+    cells = pool.cells[:pool.size]
+    assert set(cells.tolist()) == expected
+    np.testing.assert_array_equal(pool.index[cells], np.arange(pool.size))
+    assert (pool.index >= 0).sum() == pool.size
+
+
+def test_empty_cell_pool_matches_a_set():
+    rng = random.Random(0)
+    pool = EmptyCellPool(10, 10, range(0, 100, 3))
+    expected = set(range(0, 100, 3))
+    for _ in range(2000):
+        cell = rng.randrange(100)
+        if rng.random() < 0.5:
+            pool.add(cell)
+            expected.add(cell)
+        else:
+            pool.remove(cell)
+            expected.discard(cell)
+        assert (cell in pool) == (cell in expected)
+    check_pool(pool, expected)
+    assert pool.sample(rng) in expected
+    picks = pool.sample_k(5, np.random.default_rng(0)).tolist()
+    assert len(set(picks)) == 5 and set(picks) <= expected
+
+
+def test_pooled_grid_tracks_empties():
+    model = run_steps(SchellingModel(**SMALL, seed=3), 5)
+    pool = model.grid.empty_pool
+    check_pool(pool, {pool.to_cell(pos) for pos in model.grid.empties})
+    ## reset() on the same grid clears it rather than building a new one
+    model.reset(seed=4)
+    pool = model.grid.empty_pool
+    check_pool(pool, {pool.to_cell(pos) for pos in model.grid.empties})
+
+
+def test_settle_matches_taking_turns():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n, k, cells = rng.integers(1, 40), rng.integers(1, 5), rng.integers(1, 20)
+        candidates = np.stack([rng.choice(cells, size=min(k, cells), replace=False)
+                               for _ in range(n)])
+        ok = rng.random(candidates.shape) < 0.6
+        taken, expected = set(), []
+        for row, row_ok in zip(candidates.tolist(), ok.tolist()):
+            cell = next((c for c, o in zip(row, row_ok) if o and c not in taken), -1)
+            taken.add(cell)
+            expected.append(cell)
+        assert settle(candidates, ok).tolist() == expected
+
+
+@pytest.mark.parametrize("engine", ["agent", "array"])
+def test_more_candidates_make_agents_happier(engine):
+    ## with more candidates per unhappy agent, more of them find a cell they
+    ## accept, on either engine
+    happy = {k: np.mean([share_happy(engine, k, seed, steps=3, density=0.8)
+                         for seed in range(10)]) for k in (1, 3, 10)}
+    assert happy[3] > happy[1]
+    assert happy[10] > happy[1]
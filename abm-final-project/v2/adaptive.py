@@ -0,0 +1,171 @@
+# adaptive.py
+# Adaptive parameter sweeps: a space-filling start design, a small NumPy
+# Gaussian-process surrogate fitted to finished runs, and an acquisition rule
+# that places the next batch of runs where the surrogate is most uncertain or
+# where the response (e.g. Avg_Maj_Threshold) changes fastest.
+# Points live in the unit cube; ParameterSpace maps them to model parameters.
+import numpy as np
+
+
+class ParameterSpace:
+    # dims: list of (name, low, high, log) with log=True sampled on a log scale
+
+    def __init__(self, dims):
+        self.names = [d[0] for d in dims]
+        self.low   = np.array([d[1] for d in dims], dtype=float)
+        self.high  = np.array([d[2] for d in dims], dtype=float)
+        self.log   = np.array([d[3] for d in dims], dtype=bool)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _log(self, v):
+        # log only on the log-scaled columns (others may include 0)
+        return np.where(self.log, np.log(np.where(self.log, v, 1.0)), v)
+
+    def _bounds(self):
+        return self._log(self.low), self._log(self.high)
+
+    def to_values(self, u):
+        # unit-cube points (n, d) -> parameter values (n, d)
+        low, high = self._bounds()
+        v = low + np.asarray(u) * (high - low)
+        return np.where(self.log, np.exp(v), v)
+
+    def to_unit(self, values):
+        low, high = self._bounds()
+        v = np.asarray(values, dtype=float)
+        v = self._log(v)
+        return (v - low) / (high - low)
+
+
+def latin_hypercube(n, d, rng):
+    # one point in each of n equal strata per dimension, strata paired at random
+    strata = np.argsort(rng.random((n, d)), axis=0)
+    return (strata + rng.random((n, d))) / n
+
+
+def sobol(n, d, seed):
+    try:
+        from scipy.stats import qmc
+    except ImportError as e:
+        raise ImportError("Sobol designs need scipy: pip install scipy") from e
+    return qmc.Sobol(d, scramble=True, seed=seed).random(n)
+
+
+def initial_design(n, d, method="lhs", seed=0):
+    if method == "sobol":
+        return sobol(n, d, seed)
+    if method == "lhs":
+        return latin_hypercube(n, d, np.random.default_rng(seed))
+    raise ValueError(f"unknown design {method!r}, expected 'lhs' or 'sobol'")
+
+
+class GaussianProcess:
+    # Zero-mean GP on standardised targets with an anisotropic RBF kernel.
+    # Lengthscales and noise are picked from small grids by log marginal
+    # likelihood: first one shared lengthscale, then one pass per dimension.
+
+    LENGTHSCALES = (0.05, 0.1, 0.2, 0.35, 0.6, 1.0, 2.0)
+    NOISES       = (1e-4, 1e-3, 1e-2, 1e-1, 0.3)
+
+    def fit(self, X, y):
+        self.X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.y_mean = y.mean()
+        self.y_std  = y.std() or 1.0
+        self.z = (y - self.y_mean) / self.y_std
+        d = self.X.shape[1]
+
+        best = max(((self._log_likelihood(np.full(d, l), s), l, s)
+                    for l in self.LENGTHSCALES for s in self.NOISES))
+        _, l, noise = best
+        scales = np.full(d, l)
+        for j in range(d):
+            for l in self.LENGTHSCALES:
+                trial = scales.copy()
+                trial[j] = l
+                ll = self._log_likelihood(trial, noise)
+                if ll > best[0]:
+                    best = (ll, l, noise)
+                    scales = trial
+        self.lengthscales = scales
+        self.noise = noise
+        self._factor(self.X, self.z)
+        return self
+
+    def _kernel(self, A, B, scales):
+        diff = (A[:, None, :] - B[None, :, :]) / scales
+        return np.exp(-0.5 * (diff ** 2).sum(axis=-1))
+
+    def _log_likelihood(self, scales, noise):
+        K = self._kernel(self.X, self.X, scales) + noise * np.eye(len(self.X))
+        try:
+            L = np.linalg.cholesky(K)
+        except np.linalg.LinAlgError:
+            return -np.inf
+        a = np.linalg.solve(L.T, np.linalg.solve(L, self.z))
+        return -0.5 * self.z @ a - np.log(np.diag(L)).sum()
+
+    def _factor(self, X, z):
+        self.X_train = X
+        K = self._kernel(X, X, self.lengthscales) + self.noise * np.eye(len(X))
+        self.L = np.linalg.cholesky(K)
+        self.alpha = np.linalg.solve(self.L.T, np.linalg.solve(self.L, z))
+        self.z_train = z
+
+    def condition(self, x, z):
+        # add pseudo-observations (standardised) without refitting hyperparameters
+        self._factor(np.vstack([self.X_train, x]), np.concatenate([self.z_train, z]))
+
+    def predict(self, X, gradient=False):
+        # posterior mean and std in target units; optionally the mean's
+        # gradient with respect to the unit-cube coordinates
+        X = np.asarray(X, dtype=float)
+        k = self._kernel(X, self.X_train, self.lengthscales)
+        mean = k @ self.alpha
+        v = np.linalg.solve(self.L, k.T)
+        var = np.maximum(1.0 - (v ** 2).sum(axis=0), 0.0)
+        out = (self.y_mean + self.y_std * mean, self.y_std * np.sqrt(var))
+        if not gradient:
+            return out
+        diff = (self.X_train[None, :, :] - X[:, None, :]) / self.lengthscales ** 2
+        grad = np.einsum("nm,nmd,m->nd", k, diff, self.alpha) * self.y_std
+        return out + (grad,)
+
+
+ACQUISITIONS = ("uncertainty", "gradient", "both")
+
+
+def acquisition_scores(std, grad, kind="both"):
+    # each term scaled to [0, 1] over the candidates so they can be added
+    if kind not in ACQUISITIONS:
+        raise ValueError(f"unknown acquisition {kind!r}, expected one of {ACQUISITIONS}")
+    slope = np.linalg.norm(grad, axis=1)
+    score = np.zeros(len(std))
+    if kind in ("uncertainty", "both"):
+        score += std / (std.max() or 1.0)
+    if kind in ("gradient", "both"):
+        score += slope / (slope.max() or 1.0)
+    return score
+
+
+def propose(X, y, batch_size, kind="both", n_candidates=2000, rng=None):
+    # next batch of unit-cube points. Points are picked one at a time; after
+    # each pick the GP is conditioned on its own prediction there ("kriging
+    # believer"), which shrinks the uncertainty around it so the batch spreads
+    # out instead of piling onto one peak.
+    rng = rng if rng is not None else np.random.default_rng()
+    X = np.asarray(X, dtype=float)
+    gp = GaussianProcess().fit(X, y)
+    candidates = latin_hypercube(n_candidates, X.shape[1], rng)
+    _, _, grad = gp.predict(candidates, gradient=True)
+    chosen = []
+    for _ in range(min(batch_size, n_candidates)):
+        mean, std = gp.predict(candidates)
+        score = acquisition_scores(std, grad, kind)
+        score[chosen] = -np.inf
+        i = int(np.argmax(score))
+        chosen.append(i)
+        gp.condition(candidates[i:i + 1], (mean[i:i + 1] - gp.y_mean) / gp.y_std)
+    return candidates[chosen], gp
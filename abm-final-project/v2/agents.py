@@ -1,24 +1,53 @@
 # agents.py
 from mesa import Agent
-from collections import deque
-import random
+
+# Small-int codes for agent state, shared with the array engine
+MAJORITY = 0
+MINORITY = 1
+
+NEUTRAL = 0
+HOSTILE = 1
+
+MEMORY_SIZE = 5
+MEMORY_MASK = (1 << MEMORY_SIZE) - 1
 
 
 class EthnicAgent(Agent):
+    # Mesa's Agent has no __slots__, so agents still carry a __dict__; it stays
+    # empty because every attribute set here has a slot, which saves only ~8
+    # bytes per agent. The compact state's real saving is the bit-packed
+    # memory below, which replaces a 760-byte deque(maxlen=5) per agent.
+    __slots__ = ("unique_id", "model", "pos", "ethnicity", "grievance",
+                 "violence_threshold", "aversion", "memory", "memory_len", "memory_hostile")
+
     def __init__(self, unique_id, model, ethnicity, grievance, violence_threshold, aversion=0.1):
         # Mesa‐required fields
         self.unique_id = unique_id
         self.model     = model
         self.pos       = None
+        self.reset(ethnicity, grievance, violence_threshold, aversion)
 
-        # Agent state
+    def reset(self, ethnicity, grievance, violence_threshold, aversion=0.1):
+        # Agent state, also used to recycle the object for a new run
         self.ethnicity          = ethnicity
         self.grievance          = grievance
         self.violence_threshold = violence_threshold
         self.aversion           = aversion
 
-        # Personal memory of last 5 interactions
-        self.memory = deque(maxlen=5)
+        # Personal memory of last 5 interactions, bit-packed with the newest in
+        # bit 0, plus running counts so reads never rescan it
+        self.memory         = 0
+        self.memory_len     = 0
+        self.memory_hostile = 0
+
+    def remember(self, interaction):
+        if self.memory_len == MEMORY_SIZE:
+            # the oldest outcome falls off the top
+            self.memory_hostile -= self.memory >> (MEMORY_SIZE - 1)
+        else:
+            self.memory_len += 1
+        self.memory = ((self.memory << 1) | interaction) & MEMORY_MASK
+        self.memory_hostile += interaction
 
     def step(self):
         self.interact()
@@ -27,60 +56,57 @@ class EthnicAgent(Agent):
 
     def interact(self):
         # 1) get neighbors
-        cells = self.model.grid.get_neighborhood(
-            self.pos, moore=True, include_center=False, radius=self.model.vision
-        )
-        nbrs = [a for cell in cells for a in self.model.grid.get_cell_list_contents(cell)]
-        out = [a for a in nbrs if a.ethnicity != self.ethnicity]
-        if not out:
+        grid = self.model.grid
+        out = grid.out_group_cells(self.model.vision_cells.indices(self.pos), self.ethnicity)
+        if not len(out):
             return
-        partner = random.choice(out)
+        partner = grid.agent_at[self.model.interaction_random.choice(out)]
 
         # 2) determine outcome
         sum_g      = self.grievance + partner.grievance
         p_violence = min(sum_g / 2, 1.0)
-        if random.random() < p_violence:
-            interaction = "hostile"
+        if self.model.interaction_random.random() < p_violence:
+            interaction = HOSTILE
             self.grievance    = min(self.grievance    + self.model.alpha, 1)
             partner.grievance = min(partner.grievance + self.model.alpha, 1)
         else:
-            interaction = "neutral"
+            interaction = NEUTRAL
             self.grievance    = max(self.grievance    - self.model.beta, 0)
             partner.grievance = max(partner.grievance - self.model.beta, 0)
 
         # 3) record BOTH in model log (for cell) and in each agent’s personal memory
         self.model.record_interaction(interaction, self.pos)
-        self.memory.append(interaction)
-        partner.memory.append(interaction)
+        self.remember(interaction)
+        partner.remember(interaction)
 
     def update_internal_state(self):
         # decay grievance
         self.grievance *= self.model.decay
 
         # majority updates threshold from personal memory
-        if self.ethnicity == "majority" and self.memory:
-            v = self.memory.count("hostile") / len(self.memory)
-            n = self.memory.count("neutral") / len(self.memory)
+        if self.ethnicity == MAJORITY and self.memory_len:
+            v = self.memory_hostile / self.memory_len
+            n = (self.memory_len - self.memory_hostile) / self.memory_len
             delta = -self.model.alpha * v * self.violence_threshold \
                     + self.model.beta  * n * (1 - self.violence_threshold)
             self.violence_threshold = min(max(self.violence_threshold + delta, 0), 1)
 
     def move(self):
-        cells = self.model.grid.get_neighborhood(
-            self.pos, moore=True, include_center=False, radius=1
-        )
-        empty = [cell for cell in cells if not self.model.grid.get_cell_list_contents(cell)]
-        if not empty:
+        grid  = self.model.grid
+        empty = grid.empty_cells(self.model.adjacent_cells.indices(self.pos))
+        if not len(empty):
             return
 
-        # score each candidate by cell‐level violence log
-        candidates = [self.pos] + empty
-        def violence_score(cell):
-            return sum(1 for i in self.model.interactions_log.get(cell, []) if i == "hostile")
-        best = min(candidates, key=violence_score)
+        # score each candidate by cell‐level violence log; the current cell
+        # comes first, so it wins ties
+        hostile = self.model.cell_hostile
+        scores  = hostile[empty]
+        i = int(scores.argmin())
+        best = empty[i] if scores[i] < hostile[grid.cell(self.pos)] else None
 
         # move toward most peaceful with prob aversion, else random
-        if best != self.pos and random.random() < self.aversion:
-            self.model.grid.move_agent(self, best)
-        elif random.random() < (1 - self.aversion):
-            self.model.grid.move_agent(self, random.choice(empty))
+        rand = self.model.movement_random
+        if best is not None and rand.random() < self.aversion:
+            self.model.grid.move_agent(self, divmod(int(best), grid.height))
+        elif rand.random() < (1 - self.aversion):
+            self.model.grid.move_agent(self, divmod(int(rand.choice(empty)), grid.height))
@@ -1,8 +1,23 @@
+import os
 from model import EthnicViolenceModel
+from recording import ReplayModel, Recording
+from agents import MAJORITY, MINORITY
+from raster import categorical, make_raster_component
 from mesa.visualization import Slider, SolaraViz, make_plot_component, make_space_component
 
+# The grid is drawn as one raster image from the model's cell arrays, which
+# stays fast up to 300x300; SPACE=markers draws one matplotlib marker per agent
+# instead. RENDER_INTERVAL=n advances n steps per redraw (also a UI slider).
+SPACE = os.environ.get("SPACE", "raster")
+RENDER_INTERVAL = int(os.environ.get("RENDER_INTERVAL", 1))
+
 def agent_portrayal(agent):
-    return {"color":"red" if agent.ethnicity=="majority" else "blue","marker":"s","size":2}
+    return {"color":"red" if agent.ethnicity==MAJORITY else "blue","marker":"s","size":2}
+
+def grid_colors(layers):
+    # red majority, blue minority, paler at lower grievance
+    return categorical(layers["ethnicity"], {MAJORITY: (0.84, 0.15, 0.16), MINORITY: (0.12, 0.47, 0.71)},
+                       shade=layers["grievance"])
 
 model_params = {
     "width":        Slider("Grid Width",    80,20,300,1),
@@ -15,12 +30,27 @@ model_params = {
     "vision":       Slider("Vision",        1,  1,  5,  1),
 }
 
-# pull defaults
-default_kwargs = {k:v.value for k,v in model_params.items()}
-print("Default model parameters:", default_kwargs)
-eth_model = EthnicViolenceModel(**default_kwargs)
+# REPLAY=<dir> plays back a run saved by recording.py instead of simulating;
+# the start frame slider scrubs through it
+replay = os.environ.get("REPLAY")
+if replay:
+    frames = len(Recording(replay))
+    model_params = {
+        "path":   replay,
+        "frame":  Slider("Start Frame", 0, 0, max(frames - 1, 0), 1),
+        "agents": SPACE != "raster",
+    }
+    eth_model = ReplayModel(replay, agents=SPACE != "raster")
+else:
+    # pull defaults
+    default_kwargs = {k:v.value for k,v in model_params.items()}
+    print("Default model parameters:", default_kwargs)
+    eth_model = EthnicViolenceModel(**default_kwargs)
 
-SpaceGraph = make_space_component(agent_portrayal=agent_portrayal)
+if SPACE == "raster":
+    SpaceGraph = make_raster_component(grid_colors)
+else:
+    SpaceGraph = make_space_component(agent_portrayal=agent_portrayal)
 MajPlot    = make_plot_component("Avg_Maj_Grievance")
 MinPlot    = make_plot_component("Avg_Min_Grievance")
 ThrPlot    = make_plot_component("Avg_Maj_Threshold")
@@ -44,5 +74,6 @@ page = SolaraViz(
     components=[SpaceGraph, MajPlot, MinPlot, ThrPlot, VioPlot],
     model_params=model_params,
     name="Ethnic Violence ABM",
+    render_interval=RENDER_INTERVAL,
     chart_opts=chart_options,   # <-- pass your Chart.js config here
 )
@@ -1,9 +1,22 @@
 import os
+import sys
+import json
+import glob
+import signal
+import argparse
 import itertools
+import functools
 import multiprocessing as mp
-import pandas as pd
 import logging
-from model import EthnicViolenceModel
+import numpy as np
+import pandas as pd
+from model import EthnicViolenceModel, REPORTERS, PARAMS
+from replicates import ReplicateBatch
+from sweep import (ResultStore, ParquetResultStore, task_key, task_seed, shard_tasks,
+                   merge_results, available_cpus, SharedResults, ResultCache, result_key,
+                   code_version)
+from scheduling import CostModel, Scheduler
+from adaptive import ParameterSpace, initial_design, propose, ACQUISITIONS
 
 # Configure file logger
 logging.basicConfig(
@@ -25,16 +38,70 @@ DECAY = [round(v / 100, 2) for v in range(50, 100, 10)]
 VISION = [1]
 AVERSION = [round(v / 100, 2) for v in range(0, 51, 10)]
 ITERATIONS = 2
+BASE_SEED = 40550
+COMMON_RANDOM_NUMBERS = True   # same seed for iteration i at every grid point
 MAX_STEPS = 50
-NUM_PROCESSES = 99
+CONVERGENCE_TOL = 1e-4      # stop a run once all reporters change by less than this...
+CONVERGENCE_PATIENCE = 5    # ...for this many consecutive steps (None tolerance: always MAX_STEPS)
+# Also stop once no grievance exceeds this. Avg_Maj_Threshold keeps drifting
+# in calm runs, so this freezes it early; None keeps running to MAX_STEPS.
+CALM_GRIEVANCE = None
+NUM_PROCESSES = None   # None: size the pool from the CPUs allocated to this job
+CHUNK_SIZE = 100   # results buffered before each append to the results file
+# Sweeps write here under stable names, so a restarted job finds its results
+# again; the committed results of earlier sweeps next to this script are never
+# opened as a store
+RESULTS_DIR = 'sweep_results'
+REUSE_MODELS = True   # workers reset() one model per process instead of building one per task
+# dispatch the (estimated) longest tasks first and chunk cheap ones; False
+# (or --grid-order) sends tasks one at a time in grid order
+COST_SCHEDULING = True
+# numeric outputs workers write in place with --shared-memory
+SHARED_COLUMNS = ['step_count', *REPORTERS, 'converged_at']
+# Finished runs are cached by content (parameters, seed, MAX_STEPS, the
+# convergence settings and a hash of MODEL_FILES), so overlapping or extended
+# sweeps only run new points; --no-cache turns it off. Sharded runs each keep
+# their own cache file next to CACHE_PATH (see cache_file), which merge folds
+# into CACHE_PATH
+CACHE_PATH = 'ethnic_violence_cache.sqlite'
+CACHE_MAX_MB = 1024    # least recently used runs are evicted beyond this
+MODEL_FILES = ['model.py', 'agents.py', 'array_engine.py', 'kernel.py', 'neighbourhood.py',
+               'occupancy.py', 'replicates.py']
+
+# Adaptive sweep (`python batch_custom.py adaptive`): samples the ranges of the
+# grid above continuously instead of running the full product
+ADAPTIVE_TARGET = 'Avg_Maj_Threshold'   # response the surrogate models
+ADAPTIVE_INITIAL = 64        # points in the start design
+ADAPTIVE_BATCH = 32          # points added per round
+ADAPTIVE_ROUNDS = 10
+ADAPTIVE_DESIGN = 'lhs'      # 'lhs' or 'sobol' (needs scipy)
+ADAPTIVE_ACQUISITION = 'both'   # 'uncertainty', 'gradient' or 'both'
+
+# one long-lived model per worker process, reset() for every task
+_model = None
+
+
+def worker_model(**kwargs):
+    global _model
+    if not REUSE_MODELS:
+        return EthnicViolenceModel(**kwargs)
+    if _model is None:
+        _model = EthnicViolenceModel(**kwargs)
+    else:
+        _model.reset(**kwargs)
+    return _model
+
 
 # Worker function
-def run_model(task):
+def run_model(task, trajectories=False, profile=False):
     params, iteration = task
     pid = os.getpid()
     logger.debug(f"[PID {pid}] Starting iteration {iteration} with params {params}")
 
-    model = EthnicViolenceModel(**params)
+    seed = task_seed(params, iteration, BASE_SEED, common=COMMON_RANDOM_NUMBERS)
+    model = worker_model(**params, seed=seed, convergence_tol=CONVERGENCE_TOL,
+                         convergence_patience=CONVERGENCE_PATIENCE,
+                         calm_grievance=CALM_GRIEVANCE, instrument=profile)
     step = 0
     while step < MAX_STEPS and model.running:
         model.step()
@@ -47,12 +114,181 @@ def run_model(task):
     except Exception:
         final_data = {'step_count': step}
 
-    result = {**params, 'iteration': iteration, 'step_count': step, **final_data}
+    result = {**params, 'iteration': iteration, 'seed': seed, 'step_count': step, **final_data,
+              'converged_at': model.converged_at,
+              'task_key': task_key(params, iteration)}
+    if trajectories:
+        result['trajectory'] = model.datacollector.get_model_vars_dataframe()
+    if profile:
+        # per-run phase timings, call counts and neighbour queries as one JSON column
+        result['profile'] = json.dumps(model.profiler.summary())
     logger.debug(f"[PID {pid}] Finished iteration {iteration}")
     return result
 
-if __name__ == '__main__':
-    # Build task list using alpha/beta ratios
+def run_replicates(group):
+    # all remaining iterations of one grid point as a single ReplicateBatch on
+    # the array engine; returns one result per iteration, as run_model would
+    params, iterations = group
+    seeds = [task_seed(params, it, BASE_SEED, common=COMMON_RANDOM_NUMBERS) for it in iterations]
+    model_params = {k: v for k, v in params.items() if k != 'engine'}
+    batch = ReplicateBatch(seeds, **model_params, convergence_tol=CONVERGENCE_TOL,
+                           convergence_patience=CONVERGENCE_PATIENCE,
+                           calm_grievance=CALM_GRIEVANCE)
+    df = batch.run(MAX_STEPS)
+    df['seed'] = seeds
+    results = []
+    for it, row in zip(iterations, df.to_dict('records')):
+        converged = row.pop('converged_at')
+        results.append({**params, 'iteration': it, **row,
+                        'converged_at': None if pd.isna(converged) else int(converged),
+                        'task_key': task_key(params, it)})
+    return results
+
+
+# worker-side view of the parent's shared result table, set by attach_shared
+_shared = None
+
+
+def attach_shared(name):
+    global _shared
+    _shared = SharedResults(SHARED_COLUMNS, name=name)
+
+
+def run_model_shared(indexed_task):
+    # run one task, write its outputs into its row of the shared table and
+    # send back only the row index
+    index, task = indexed_task
+    _shared.write(index, run_model(task))
+    return index
+
+
+def run_replicates_shared(indexed_group):
+    indices, group = indexed_group
+    for index, res in zip(indices, run_replicates(group)):
+        _shared.write(index, res)
+    return indices
+
+
+def shared_result(task, values):
+    # the run_model result for `task`, rebuilt in the parent from its shared row
+    params, iteration = task
+    converged = values['converged_at']
+    return {**params, 'iteration': iteration,
+            'seed': task_seed(params, iteration, BASE_SEED, common=COMMON_RANDOM_NUMBERS),
+            'step_count': int(values['step_count']),
+            **{name: values[name] for name in REPORTERS},
+            'converged_at': None if np.isnan(converged) else int(converged),
+            'task_key': task_key(params, iteration)}
+
+
+@functools.lru_cache(maxsize=None)
+def model_code_version():
+    here = os.path.dirname(os.path.abspath(__file__))
+    return code_version([os.path.join(here, f) for f in MODEL_FILES])
+
+
+def run_cache_key(task):
+    # the engine is one of the params, so each engine's runs are cached apart
+    params, iteration = task
+    seed = task_seed(params, iteration, BASE_SEED, common=COMMON_RANDOM_NUMBERS)
+    return result_key(params, seed, MAX_STEPS, model_code_version(),
+                      convergence_tol=CONVERGENCE_TOL,
+                      convergence_patience=CONVERGENCE_PATIENCE,
+                      calm_grievance=CALM_GRIEVANCE)
+
+
+def result_columns(params, profile=False):
+    # every column run_model, run_replicates and the cache give a result
+    columns = [*params, 'iteration', 'seed', 'step_count', *REPORTERS, 'converged_at']
+    if profile:
+        columns.append('profile')
+    return columns + ['task_key']
+
+
+def cache_value(res):
+    # what a run produced, without the task's own identity
+    return {k: v for k, v in res.items()
+            if k not in PARAMS and k not in ('iteration', 'task_key', 'round')}
+
+
+def split_cached(cache, tasks):
+    # (results of the tasks found in the cache, tasks still to run,
+    #  task_key -> cache key for all of them)
+    keys = {task_key(*t): run_cache_key(t) for t in tasks}
+    hits = cache.get_many(keys.values())
+    cached, todo = [], []
+    for params, it in tasks:
+        value = hits.get(keys[task_key(params, it)])
+        if value is None:
+            todo.append((params, it))
+        else:
+            cached.append({**params, 'iteration': it, **value, 'task_key': task_key(params, it)})
+    return cached, todo, keys
+
+
+def cache_file(path, shard_index=0, shard_count=1):
+    # Array tasks run on different nodes, where one shared SQLite file is not
+    # safe to write, so every shard of a sharded run has a cache of its own.
+    # A rerun with the same shard count finds its shard's earlier runs there.
+    if shard_count == 1:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_shard{shard_index:03d}of{shard_count:03d}{ext}"
+
+
+def open_cache(args, shard_index=0, shard_count=1):
+    if args.no_cache or args.trajectories or args.profile:
+        # trajectories and profiles are not cached, so those runs always simulate
+        return None
+    # the shards' caches together stay within CACHE_MAX_MB
+    return ResultCache(cache_file(args.cache, shard_index, shard_count),
+                       max_bytes=(CACHE_MAX_MB << 20) // shard_count, chunk_size=CHUNK_SIZE)
+
+
+def task_features(task):
+    # runtime features of a task (params, iteration) or a batched grid point
+    # (params, [iterations]) for the scheduler's cost model: a prior cost first
+    # (agents x cells in vision, per replicate), then the parameters that
+    # drive how much interaction and movement a run has
+    params, iterations = task
+    replicates = len(iterations) if isinstance(iterations, list) else 1
+    agents = params['width'] * params['height'] * params['density']
+    return [replicates * agents * (2 * params['vision'] + 1) ** 2, params['decay'],
+            params['alpha'], params['beta'], params['aversion'], params['majority_pct']]
+
+
+def make_scheduler(pool, processes, args, features=task_features):
+    cost = None if args.grid_order or not COST_SCHEDULING else CostModel(features)
+    return functools.partial(Scheduler, pool, processes=processes, cost=cost)
+
+
+def log_schedule(prefix, scheduler):
+    r = scheduler.report()
+    logger.info(f"{prefix} Scheduling: {r['tasks']} work items in {r['chunks']} chunks, "
+                f"worker utilization {r['utilization']:.1%} ({r['busy_s']:.0f}s busy over "
+                f"{r['wall_s']:.0f}s wall), tail {r['tail_s']:.0f}s after the last dispatch")
+
+
+def group_tasks(tasks):
+    # (params, [iterations]) per grid point, in first-seen order
+    groups = {}
+    for params, it in tasks:
+        key = task_key(params, None)
+        if key not in groups:
+            groups[key] = (params, [])
+        groups[key][1].append(it)
+    return list(groups.values())
+
+
+def sweep_engine(args):
+    # --batched runs replicate batches on the array engine
+    return 'array' if args.batched else 'agent'
+
+
+def build_tasks(engine='agent'):
+    # Build task list using alpha/beta ratios. The engine is one of each
+    # task's params, so it is part of the task key and a column of the
+    # results: runs of different engines never pass for each other.
     param_grid = []
     for mpct, den, alp, ratio, dec, vis, avr in itertools.product(
         MAJORITY_PCT, DENSITY, ALPHA, RATIOS, DECAY, VISION, AVERSION
@@ -70,40 +306,346 @@ if __name__ == '__main__':
             'beta': beta,
             'decay': dec,
             'vision': vis,
-            'aversion': avr
+            'aversion': avr,
+            'engine': engine,
         })
 
-    tasks = [(params, it) for params in param_grid for it in range(ITERATIONS)]
+    return [(params, it) for params in param_grid for it in range(ITERATIONS)]
+
+
+def adaptive_space():
+    # alpha/beta ratio on a log scale, as the grid's ratios are denser near 1
+    return ParameterSpace([
+        ('alpha', min(ALPHA), max(ALPHA), False),
+        ('ratio', min(RATIOS), max(RATIOS), True),
+        ('decay', min(DECAY), max(DECAY), False),
+        ('aversion', min(AVERSION), max(AVERSION), False),
+    ])
+
+
+def adaptive_tasks(space, points):
+    tasks = []
+    for alp, ratio, dec, avr in space.to_values(points):
+        alp = round(float(alp), 6)
+        params = {
+            'width': WIDTH,
+            'height': HEIGHT,
+            'majority_pct': MAJORITY_PCT[0],
+            'density': DENSITY[0],
+            'alpha': alp,
+            'beta': round(alp / float(ratio), 12),
+            'decay': round(float(dec), 6),
+            'vision': VISION[0],
+            'aversion': round(float(avr), 6),
+            'engine': 'agent',
+        }
+        tasks += [(params, it) for it in range(ITERATIONS)]
+    return tasks
+
+
+def adaptive_data(path, space, before_round):
+    # surrogate training data: one unit-cube point per parameter set, target
+    # averaged over iterations, using only rounds before `before_round` so a
+    # restarted sweep proposes exactly the same points again
+    df = pd.read_csv(path)
+    df = df[df['round'] < before_round]
+    df = df.assign(ratio=df['alpha'] / df['beta'])
+    points = df.groupby(space.names, sort=True)[ADAPTIVE_TARGET].mean().reset_index()
+    return space.to_unit(points[space.names].to_numpy()), points[ADAPTIVE_TARGET].to_numpy()
+
+
+def output_file(total_tasks, engine, shard_index=0, shard_count=1, fmt="csv"):
+    name = f"ethnic_violence_batch_results_{total_tasks}_{engine}"
+    if fmt == "parquet":
+        # one partitioned dataset directory shared by all shards
+        name += ".parquet"
+    elif shard_count == 1:
+        name += ".csv"
+    else:
+        name += f"_shard{shard_index:03d}of{shard_count:03d}.csv"
+    return os.path.join(RESULTS_DIR, name)
+
+
+def merged_file(total_tasks, engine):
+    # merge output, never the name of a results store
+    return os.path.join(RESULTS_DIR,
+                        f"ethnic_violence_batch_results_{total_tasks}_{engine}_merged.csv")
+
+
+def run(args):
+    engine = sweep_engine(args)
+    tasks = build_tasks(engine)
     total_tasks = len(tasks)
-    logger.info(f"Total tasks to run (alpha/beta ratios applied): {total_tasks}")
+    if args.batched:
+        # shard whole grid points so each point's iterations batch together
+        groups = shard_tasks(group_tasks(tasks), args.shard_index, args.shard_count)
+        tasks = [(params, it) for params, iterations in groups for it in iterations]
+    else:
+        tasks = shard_tasks(tasks, args.shard_index, args.shard_count)
+    shard = f"[shard {args.shard_index}/{args.shard_count}]"
+    logger.info(f"{shard} Total tasks to run (alpha/beta ratios applied): {total_tasks}, "
+                f"{len(tasks)} in this shard")
+
+    # Results are appended in chunks to a file named after the grid size and
+    # shard, so a restarted job finds it again and skips every task already
+    # recorded there
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = output_file(total_tasks, engine, args.shard_index, args.shard_count, args.format)
+    if args.format == "parquet":
+        store = ParquetResultStore(path, chunk_size=CHUNK_SIZE)
+    else:
+        store = ResultStore(path, chunk_size=CHUNK_SIZE)
+        # e.g. --profile toggled on a resumed sweep; fail before running anything
+        if tasks:
+            store.check_columns(result_columns(tasks[0][0], args.profile))
+    done = store.done_keys()
+    shard_total = len(tasks)
+    tasks = [t for t in tasks if task_key(*t) not in done]
+    logger.info(f"{shard} Resuming from {path}: {shard_total - len(tasks)} tasks already done, "
+                f"{len(tasks)} remaining")
+
+    # runs any earlier sweep already did (same model code) come from the cache
+    cache = open_cache(args, args.shard_index, args.shard_count)
+    cached = []
+    if cache is not None:
+        cached, tasks, cache_keys = split_cached(cache, tasks)
+        logger.info(f"{shard} Result cache {cache.path}: {len(cached)} tasks cached, "
+                    f"{len(tasks)} to run")
+
+    # SLURM sends SIGTERM at the time limit; exit normally so the store flushes
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    processes = args.processes or available_cpus()
+    logger.info(f"{shard} Starting pool with {processes} processes")
+
+    # With --shared-memory workers write numeric outputs into a shared table
+    # indexed by task and return only the index; the parent rebuilds each row
+    shared = SharedResults(SHARED_COLUMNS, len(tasks)) if args.shared_memory else None
 
     # Use spawn context to avoid fork issues on HPC
     ctx = mp.get_context('spawn')
-    pool = ctx.Pool(processes=NUM_PROCESSES)
+    if shared is not None:
+        pool = ctx.Pool(processes=processes, initializer=attach_shared, initargs=(shared.name,))
+    else:
+        pool = ctx.Pool(processes=processes)
 
-    results = []
-    completed = 0
-    next_pct = 1
+    # the scheduler times each task in its worker, for the utilization report
+    schedule = make_scheduler(pool, processes, args)
+    # shared-memory items carry their row index(es) ahead of the task
+    schedule_indexed = make_scheduler(pool, processes, args,
+                                      features=lambda item: task_features(item[1]))
+
+    completed = shard_total - len(tasks)
+    next_pct = int(completed * 100 / max(1, shard_total)) + 1
     # Track progress as tasks complete and log every 1%
-    for res in pool.imap_unordered(run_model, tasks):
-        completed += 1
-        results.append(res)
-        logger.info(
-            f"Completed: iteration={res['iteration']}, "
-            #f"params={{" + ", ".join(f"{k}={v}" for k, v in res.items() if k not in ['iteration', 'step_count']) + "}}, "
-            f"steps={res['step_count']}"
-        )
-        pct = int(completed * 100 / total_tasks)
-        if pct >= next_pct:
-            logger.info(f"Progress: {pct}% ({completed}/{total_tasks}) tasks completed")
-            next_pct = pct + 1
+    try:
+        with store:
+            for res in cached:
+                store.add(res)
+            if shared is not None and args.batched:
+                index = {task_key(*t): i for i, t in enumerate(tasks)}
+                groups = [([index[task_key(params, it)] for it in iterations], (params, iterations))
+                          for params, iterations in group_tasks(tasks)]
+                scheduler = schedule_indexed(run_replicates_shared)
+                rows = (i for batch in scheduler.run(groups) for i in batch)
+                results = (shared_result(tasks[i], shared.row(i)) for i in rows)
+            elif shared is not None:
+                scheduler = schedule_indexed(run_model_shared)
+                rows = scheduler.run(list(enumerate(tasks)))
+                results = (shared_result(tasks[i], shared.row(i)) for i in rows)
+            elif args.batched:
+                scheduler = schedule(run_replicates)
+                batches = scheduler.run(group_tasks(tasks))
+                results = (res for batch in batches for res in batch)
+            else:
+                worker = functools.partial(run_model, trajectories=args.trajectories,
+                                           profile=args.profile)
+                scheduler = schedule(worker)
+                results = scheduler.run(tasks)
+            for res in results:
+                completed += 1
+                store.add(res)
+                if cache is not None:
+                    cache.add(cache_keys[res['task_key']], cache_value(res))
+                logger.info(
+                    f"{shard} Completed: iteration={res['iteration']}, "
+                    #f"params={{" + ", ".join(f"{k}={v}" for k, v in res.items() if k not in ['iteration', 'step_count']) + "}}, "
+                    f"steps={res['step_count']}"
+                )
+                pct = int(completed * 100 / shard_total)
+                if pct >= next_pct:
+                    logger.info(f"{shard} Progress: {pct}% ({completed}/{shard_total}) tasks completed")
+                    next_pct = pct + 1
+
+        pool.close()
+        pool.join()
+        log_schedule(shard, scheduler)
+        if shared is not None:
+            unfilled = int(shared.frame()['step_count'].isna().sum())
+            logger.info(f"{shard} Shared result table: {len(tasks) - unfilled} rows written, "
+                        f"{unfilled} empty")
+    finally:
+        if shared is not None:
+            pool.terminate()
+            shared.close()
+        if cache is not None:
+            cache.close()
+
+    logger.info(f"{shard} All tasks done. Results saved to {path}")
+
+
+def adaptive(args):
+    space = adaptive_space()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"ethnic_violence_adaptive_results_"
+                                     f"{args.initial}+{args.rounds}x{args.batch}.csv")
+    grid_total = len(build_tasks())
+    logger.info(f"Adaptive sweep into {path}: {args.initial} start points ({args.design}), "
+                f"{args.rounds} rounds of {args.batch}, {ITERATIONS} iterations each "
+                f"(full grid: {grid_total} tasks)")
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    processes = args.processes or available_cpus()
+    ctx = mp.get_context('spawn')
+    pool = ctx.Pool(processes=processes)
+    worker = functools.partial(run_model, trajectories=False, profile=args.profile)
+    cache = open_cache(args)
+    # one cost model for all rounds, so later rounds start with its estimates
+    schedule = make_scheduler(pool, processes, args)
+
+    with ResultStore(path, chunk_size=CHUNK_SIZE) as store:
+        for rnd in range(args.rounds + 1):
+            if rnd == 0:
+                points = initial_design(args.initial, len(space), args.design, BASE_SEED)
+            else:
+                X, y = adaptive_data(path, space, rnd)
+                points, gp = propose(X, y, args.batch, args.acquisition,
+                                     rng=np.random.default_rng([BASE_SEED, rnd]))
+                logger.info(f"Round {rnd}: surrogate fitted on {len(X)} points, "
+                            f"lengthscales {np.round(gp.lengthscales, 3).tolist()}, "
+                            f"noise {gp.noise}")
+            tasks = adaptive_tasks(space, points)
+            store.check_columns(result_columns(tasks[0][0], args.profile) + ['round'])
+            done = store.done_keys()
+            todo = [t for t in tasks if task_key(*t) not in done]
+            cached = []
+            if cache is not None:
+                cached, todo, cache_keys = split_cached(cache, todo)
+            for res in cached:
+                store.add({**res, 'round': rnd})
+            scheduler = schedule(worker)
+            for res in scheduler.run(todo):
+                store.add({**res, 'round': rnd})
+                if cache is not None:
+                    cache.add(cache_keys[res['task_key']], cache_value(res))
+            # the next round's surrogate reads this round back from disk
+            store.flush()
+            logger.info(f"Round {rnd}: {len(todo)} tasks run, {len(cached)} from the cache, "
+                        f"{len(tasks) - len(todo) - len(cached)} already done")
+            log_schedule(f"Round {rnd}:", scheduler)
 
     pool.close()
     pool.join()
+    if cache is not None:
+        cache.close()
+    total = len(pd.read_csv(path))
+    logger.info(f"Adaptive sweep done: {total} runs ({total / grid_total:.1%} of the full grid)")
+    print(f"Adaptive sweep done: {total} runs in {path} ({total / grid_total:.1%} of the full grid)")
+
+
+def merge_caches(args):
+    # fold the shard caches of sharded runs into the main cache; the shard
+    # files are kept, so the same shards still hit them on a rerun
+    stem, ext = os.path.splitext(args.cache)
+    paths = sorted(glob.glob(f"{glob.escape(stem)}_shard*of*{ext}"))
+    if args.no_cache or not paths:
+        return
+    with ResultCache(args.cache, max_bytes=CACHE_MAX_MB << 20, chunk_size=CHUNK_SIZE) as cache:
+        added = sum(cache.merge(p) for p in paths)
+        entries = cache.size()[0]
+    logger.info(f"Merged {len(paths)} shard caches into {args.cache}: {added} new runs, {entries} cached")
+    print(f"Merged {len(paths)} shard caches into {args.cache}: {added} new runs, {entries} cached")
+
+
+def merge(args):
+    engine = sweep_engine(args)
+    tasks = build_tasks(engine)
+    total_tasks = len(tasks)
+    merge_caches(args)
+    if args.format == "parquet":
+        # shards already write into one dataset; just report its coverage
+        path = output_file(total_tasks, engine, fmt="parquet")
+        done = ParquetResultStore(path).done_keys()
+        missing = len({task_key(*t) for t in tasks} - done)
+        print(f"{path}: {len(done)} tasks recorded, {missing} tasks missing")
+        return
+    paths = sorted(glob.glob(os.path.join(
+        RESULTS_DIR, f"ethnic_violence_batch_results_{total_tasks}_{engine}_shard*of*.csv")))
+    path = merged_file(total_tasks, engine)
+    rows, missing = merge_results(paths, path, expected={task_key(*t) for t in tasks})
+    logger.info(f"Merged {len(paths)} shard files into {path}: {rows} rows, {missing} tasks missing")
+    print(f"Merged {len(paths)} shard files into {path}: {rows} rows, {missing} tasks missing")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ethnic violence parameter sweep")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "merge", "adaptive"],
+                        help="run one shard of the sweep, merge shard result files, "
+                             "or run a surrogate-guided adaptive sweep")
+    # shard defaults come from the SLURM job array, so a plain `sbatch --array`
+    # needs no extra arguments
+    parser.add_argument("--shard-index", type=int,
+                        default=int(os.environ.get("SLURM_ARRAY_TASK_ID", 0)))
+    parser.add_argument("--shard-count", type=int,
+                        default=int(os.environ.get("SLURM_ARRAY_TASK_COUNT", 1)))
+    parser.add_argument("--processes", type=int, default=NUM_PROCESSES,
+                        help="pool size (default: CPUs allocated to the job)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="results store: one CSV per shard, or a Parquet dataset "
+                             "partitioned by alpha/decay/aversion")
+    parser.add_argument("--trajectories", action="store_true",
+                        help="also store every step's reporters (Parquet only)")
+    parser.add_argument("--profile", action="store_true",
+                        help="instrument each run and store a per-run 'profile' column")
+    parser.add_argument("--batched", action="store_true",
+                        help="run all iterations of a grid point together as one "
+                             "vectorized replicate batch on the array engine; its results "
+                             "go to their own files (merge: merge the batched shards)")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="workers write numeric outputs into a shared-memory table "
+                             "instead of pickling result dicts back to the parent")
+    parser.add_argument("--grid-order", action="store_true",
+                        help="dispatch tasks one at a time in grid order instead of "
+                             "longest-first in cost-balanced chunks")
+    parser.add_argument("--cache", default=CACHE_PATH,
+                        help="SQLite result cache consulted before running each task; "
+                             "shards use their own file next to it (merge: combine them into it)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="run every task, without reading or filling the result cache")
+    parser.add_argument("--initial", type=int, default=ADAPTIVE_INITIAL,
+                        help="adaptive: points in the start design")
+    parser.add_argument("--batch", type=int, default=ADAPTIVE_BATCH,
+                        help="adaptive: points added per round")
+    parser.add_argument("--rounds", type=int, default=ADAPTIVE_ROUNDS,
+                        help="adaptive: number of surrogate-guided rounds")
+    parser.add_argument("--design", choices=["lhs", "sobol"], default=ADAPTIVE_DESIGN,
+                        help="adaptive: start design")
+    parser.add_argument("--acquisition", choices=ACQUISITIONS, default=ADAPTIVE_ACQUISITION,
+                        help="adaptive: place new runs where the surrogate is uncertain, "
+                             f"where {ADAPTIVE_TARGET} changes fastest, or both")
+    args = parser.parse_args()
+    if args.trajectories and args.format != "parquet":
+        parser.error("--trajectories requires --format parquet")
+    if args.batched and (args.trajectories or args.profile):
+        parser.error("--batched does not record trajectories or profiles")
+    if args.shared_memory and (args.trajectories or args.profile):
+        parser.error("--shared-memory only carries the numeric result columns")
+    if args.command == "adaptive" and (args.format != "csv" or args.trajectories):
+        parser.error("adaptive sweeps write CSV only")
 
-    # Save aggregated results
-    df = pd.DataFrame(results)
-    timestamp = pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')
-    output_file = f"ethnic_violence_batch_results_{total_tasks}_{timestamp}.csv"
-    df.to_csv(output_file, index=False)
-    logger.info(f"All tasks done. Results saved to {output_file}")
+    if args.command == "merge":
+        merge(args)
+    elif args.command == "adaptive":
+        adaptive(args)
+    else:
+        run(args)
@@ -0,0 +1,140 @@
+# benchmark.py
+# Scaling benchmark for EthnicViolenceModel: times construction and step()
+# across grid sizes, densities, vision radii and engines, each case in a fresh
+# process so peak RSS is per case. Results are saved as JSON baselines that a
+# later run can be compared against:
+#   python benchmark.py --output baseline.json
+#   python benchmark.py --compare baseline.json
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import itertools
+import multiprocessing as mp
+
+SIZES     = [20, 60, 150, 300]   # app.py sliders go from 20 to 300
+DENSITIES = [0.4, 0.7]
+VISIONS   = [1, 3, 5]
+ENGINES   = ["agent", "array", "compiled"]
+STEPS     = 5          # timed steps per repeat...
+MAX_SECONDS = 20.0     # ...unless a repeat runs over this budget (at least one step)
+REPEATS   = 3          # the fastest repeat is reported
+SEED      = 40550
+TOLERANCE = 0.2        # --compare flags cases more than 20% slower
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_case(case, steps, max_seconds, repeats):
+    # runs inside a fresh worker process
+    from model import EthnicViolenceModel
+    rss_before = peak_rss_mb()
+    best = None
+    for r in range(repeats):
+        t = time.perf_counter()
+        model = EthnicViolenceModel(width=case["size"], height=case["size"],
+                                    density=case["density"], vision=case["vision"],
+                                    engine=case["engine"], seed=SEED + r)
+        construct = time.perf_counter() - t
+        done, elapsed = 0, 0.0
+        while done < steps and (done == 0 or elapsed < max_seconds):
+            t = time.perf_counter()
+            model.step()
+            elapsed += time.perf_counter() - t
+            done += 1
+        n_agents = len(model.agent_list) if model.arrays is None else len(model.arrays.x)
+        run = {"construct_s": construct, "steps": done, "step_s": elapsed / done}
+        if best is None or run["step_s"] < best["step_s"]:
+            best = run
+    return {**case, **best,
+            "agents":            n_agents,
+            "steps_per_s":       1.0 / best["step_s"],
+            "agent_steps_per_s": n_agents / best["step_s"],
+            "peak_rss_mb":       peak_rss_mb(),
+            "rss_before_mb":     rss_before}
+
+
+def case_key(case):
+    return (case["engine"], case["size"], case["density"], case["vision"])
+
+
+def environment():
+    import numpy, mesa
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"model": "EthnicViolenceModel", "commit": commit,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+            "numpy": numpy.__version__, "mesa": mesa.__version__,
+            "machine": platform.machine(), "processor": platform.processor(),
+            "cpus": os.cpu_count()}
+
+
+def compare(results, baseline_path, tolerance):
+    # ratio of steps/sec against the baseline; returns the number of regressions
+    with open(baseline_path) as f:
+        baseline = {case_key(r): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"\ncompared with {baseline_path} (slower than -{tolerance:.0%} is flagged)")
+    for r in results:
+        old = baseline.get(case_key(r))
+        if old is None:
+            continue
+        change = r["steps_per_s"] / old["steps_per_s"] - 1
+        flag = "  REGRESSION" if change < -tolerance else ""
+        regressions += bool(flag)
+        print(f"{r['engine']:>8} size={r['size']:<4} density={r['density']:<4} "
+              f"vision={r['vision']}  {old['steps_per_s']:9.2f} -> {r['steps_per_s']:9.2f} "
+              f"steps/s ({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EthnicViolenceModel scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--densities", type=float, nargs="+", default=DENSITIES)
+    parser.add_argument("--visions", type=int, nargs="+", default=VISIONS)
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=ENGINES)
+    parser.add_argument("--steps", type=int, default=STEPS)
+    parser.add_argument("--max-seconds", type=float, default=MAX_SECONDS)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--output", help="write results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare steps/sec against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    cases = [{"engine": e, "size": s, "density": d, "vision": v} for e, s, d, v in
+             itertools.product(args.engines, args.sizes, args.densities, args.visions)]
+    # one fresh process per case: no warm caches, and peak RSS belongs to that case
+    ctx = mp.get_context("spawn")
+    results = []
+    print(f"{'engine':>8} {'size':>4} {'dens':>4} {'vis':>3} {'agents':>7} {'construct_s':>11} "
+          f"{'steps/s':>9} {'agent-steps/s':>13} {'peak_MB':>8}")
+    for case in cases:
+        with ctx.Pool(1, maxtasksperchild=1) as pool:
+            r = pool.apply(run_case, (case, args.steps, args.max_seconds, args.repeats))
+        results.append(r)
+        print(f"{r['engine']:>8} {r['size']:>4} {r['density']:>4} {r['vision']:>3} "
+              f"{r['agents']:>7} {r['construct_s']:>11.3f} {r['steps_per_s']:>9.2f} "
+              f"{r['agent_steps_per_s']:>13.0f} {r['peak_rss_mb']:>8.1f}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"\nwrote {len(results)} cases to {args.output}")
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
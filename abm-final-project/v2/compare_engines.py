@@ -0,0 +1,102 @@
+# compare_engines.py
+# Statistical check of the array engine against the sequential agent engine.
+# The compiled engine runs the agent-engine step number for number, so it
+# stands in for it here at a fraction of the cost. For every sweep point, each
+# engine runs the same seeds; the final reporters are compared as mean
+# difference in standard errors (z). Results can be saved as JSON:
+#   python compare_engines.py --seeds 20 --output engine_comparison.json
+import sys
+import json
+import argparse
+import itertools
+import multiprocessing as mp
+import numpy as np
+from model import REPORTERS
+
+# calm, intermediate and violent corners of the batch_custom.py grid
+POINTS = [
+    {"alpha": 0.05, "beta": 0.05,  "decay": 0.5, "aversion": 0.1},
+    {"alpha": 0.2,  "beta": 0.05,  "decay": 0.8, "aversion": 0.1},
+    {"alpha": 0.3,  "beta": 0.075, "decay": 0.9, "aversion": 0.1},
+    {"alpha": 0.5,  "beta": 0.1,   "decay": 0.7, "aversion": 0.3},
+    {"alpha": 0.5,  "beta": 0.02,  "decay": 0.9, "aversion": 0.0},
+]
+SIZE     = 80
+DENSITY  = 0.7
+VISION   = 1
+STEPS    = 50
+SEEDS    = 20
+BASE_SEED = 40550
+MAX_Z    = 4.0     # differences beyond this many standard errors fail the check
+
+
+def run_one(job):
+    # final reporter values of one run
+    from model import EthnicViolenceModel
+    engine, point, seed = job
+    model = EthnicViolenceModel(width=SIZE, height=SIZE, density=DENSITY, vision=VISION,
+                                engine=engine, seed=seed, **point)
+    for _ in range(STEPS):
+        model.step()
+    stats = model.stats()
+    return [stats[key] for key in REPORTERS.values()]
+
+
+def compare(point, finals, reference, engine):
+    # mean +- standard error per engine and z of the difference, per reporter
+    rows = []
+    for j, name in enumerate(REPORTERS):
+        a = np.array([f[j] for f in finals[reference]])
+        b = np.array([f[j] for f in finals[engine]])
+        se_a = a.std(ddof=1) / np.sqrt(len(a))
+        se_b = b.std(ddof=1) / np.sqrt(len(b))
+        se = np.hypot(se_a, se_b)
+        z = (b.mean() - a.mean()) / se if se > 0 else 0.0
+        rows.append({**point, "reporter": name,
+                     reference: a.mean(), f"{reference}_se": se_a,
+                     engine: b.mean(), f"{engine}_se": se_b, "z": float(z)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the array engine with the agent engine")
+    parser.add_argument("--seeds", type=int, default=SEEDS)
+    parser.add_argument("--reference", choices=["agent", "compiled"], default="compiled",
+                        help="sequential engine to compare against (compiled = agent, faster)")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--output", help="write the comparison as JSON")
+    parser.add_argument("--max-z", type=float, default=MAX_Z)
+    args = parser.parse_args()
+
+    engines = [args.reference, "array"]
+    seeds = [BASE_SEED + i for i in range(args.seeds)]
+    jobs = list(itertools.product(engines, range(len(POINTS)), seeds))
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(args.processes) as pool:
+        out = pool.map(run_one, [(e, POINTS[p], s) for e, p, s in jobs])
+
+    rows = []
+    print(f"{'alpha':>5} {'beta':>6} {'decay':>5} {'avers':>5} {'reporter':<24} "
+          f"{args.reference:>16} {'array':>16} {'z':>6}")
+    for p, point in enumerate(POINTS):
+        finals = {e: [o for (je, jp, _), o in zip(jobs, out) if je == e and jp == p]
+                  for e in engines}
+        for r in compare(point, finals, args.reference, "array"):
+            rows.append(r)
+            print(f"{r['alpha']:>5} {r['beta']:>6} {r['decay']:>5} {r['aversion']:>5} "
+                  f"{r['reporter']:<24} {r[args.reference]:>8.4f}±{r[args.reference + '_se']:.4f} "
+                  f"{r['array']:>8.4f}±{r['array_se']:.4f} {r['z']:>6.1f}")
+
+    worst = max(abs(r["z"]) for r in rows)
+    print(f"\nlargest |z| = {worst:.1f} over {len(rows)} comparisons ({args.seeds} seeds each)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"size": SIZE, "density": DENSITY, "vision": VISION, "steps": STEPS,
+                       "seeds": args.seeds, "reference": args.reference, "rows": rows}, f, indent=2)
+        print(f"wrote {args.output}")
+    if worst > args.max_z:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
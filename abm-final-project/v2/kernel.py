@@ -0,0 +1,290 @@
+# kernel.py
+# Compiled engine: the agent engine's step (a shuffle, then interact,
+# update_internal_state and move for each agent in turn, with every change
+# visible to the agents after it) as one sequential loop over plain arrays,
+# compiled with Numba when it is installed. Randomness comes from the model's
+# own stdlib Random streams: their Mersenne Twister state is copied in, stepped
+# by the kernel with the exact draws random.shuffle, random.choice and
+# random.random make, and copied back. A seed therefore gives the agent
+# engine's run number for number.
+#
+# Without Numba the model falls back to the agent engine (same results, Python
+# speed); see available().
+import numpy as np
+from agents import MAJORITY, MINORITY, HOSTILE, NEUTRAL, MEMORY_SIZE, MEMORY_MASK
+from profiling import clock
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        # plain Python stand-in, so the kernel stays importable (and testable)
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+# ---- stdlib random, replayed --------------------------------------------
+# state: int64 array of the 624 Mersenne Twister words plus the position,
+# as in random.Random.getstate()[1]
+
+@njit(cache=True)
+def _genrand(state):
+    if state[624] >= 624:
+        for i in range(624):
+            y = (state[i] & 0x80000000) | (state[(i + 1) % 624] & 0x7fffffff)
+            v = state[(i + 397) % 624] ^ (y >> 1)
+            if y & 1:
+                v ^= 0x9908b0df
+            state[i] = v
+        state[624] = 0
+    y = state[state[624]]
+    state[624] += 1
+    y ^= y >> 11
+    y ^= (y << 7) & 0x9d2c5680
+    y ^= (y << 15) & 0xefc60000
+    y ^= y >> 18
+    return y
+
+
+@njit(cache=True)
+def _random(state):
+    # random.random(): 53 bits from two words
+    a = _genrand(state) >> 5
+    b = _genrand(state) >> 6
+    return (a * 67108864.0 + b) * (1.0 / 9007199254740992.0)
+
+
+@njit(cache=True)
+def _randbelow(state, n):
+    # random.Random._randbelow_with_getrandbits, for 0 < n < 2**32
+    k = 0
+    while (n >> k) > 0:
+        k += 1
+    r = _genrand(state) >> (32 - k)
+    while r >= n:
+        r = _genrand(state) >> (32 - k)
+    return r
+
+
+@njit(cache=True)
+def _shuffle(state, x):
+    # random.shuffle
+    for i in range(len(x) - 1, 0, -1):
+        j = _randbelow(state, i + 1)
+        x[i], x[j] = x[j], x[i]
+
+
+def load_state(rand):
+    return np.array(rand.getstate()[1], dtype=np.int64)
+
+
+def store_state(rand, state):
+    version, _, gauss_next = rand.getstate()
+    rand.setstate((version, tuple(state.tolist()), gauss_next))
+
+
+# ---- the step ------------------------------------------------------------
+
+@njit(cache=True)
+def step_kernel(order, x, y, ethnicity, grievance, threshold,
+                memory, memory_len, memory_hostile,
+                cell_agent, vision_index, adjacent_index,
+                cell_log, cell_count, cell_hostile, totals,
+                schedule_state, interaction_state, movement_state,
+                height, alpha, beta, decay, aversion, max_cell_memory):
+    # one EthnicViolenceModel step of the agent engine; totals holds
+    # [hostile_total, interaction_total]
+    cell_mask = (1 << max_cell_memory) - 1
+    buf = np.empty(max(vision_index.shape[1], adjacent_index.shape[1]), dtype=np.int64)
+    _shuffle(schedule_state, order)
+
+    for a in order:
+        # -- interact: a random out-group agent within vision
+        here = x[a] * height + y[a]
+        n_out = 0
+        for k in range(vision_index.shape[1]):
+            c = vision_index[here, k]
+            if c >= 0 and cell_agent[c] >= 0 and ethnicity[cell_agent[c]] != ethnicity[a]:
+                buf[n_out] = c
+                n_out += 1
+        if n_out:
+            p = cell_agent[buf[_randbelow(interaction_state, n_out)]]
+            p_violence = min((grievance[a] + grievance[p]) / 2, 1.0)
+            if _random(interaction_state) < p_violence:
+                interaction = HOSTILE
+                grievance[a] = min(grievance[a] + alpha, 1.0)
+                grievance[p] = min(grievance[p] + alpha, 1.0)
+            else:
+                interaction = NEUTRAL
+                grievance[a] = max(grievance[a] - beta, 0.0)
+                grievance[p] = max(grievance[p] - beta, 0.0)
+
+            # the cell's log of its last max_cell_memory outcomes
+            if cell_count[here] == max_cell_memory:
+                if (cell_log[here] >> (max_cell_memory - 1)) & 1:
+                    cell_hostile[here] -= 1
+                    totals[0] -= 1
+                totals[1] -= 1
+            else:
+                cell_count[here] += 1
+            cell_log[here] = ((cell_log[here] << 1) | interaction) & cell_mask
+            totals[1] += 1
+            if interaction == HOSTILE:
+                cell_hostile[here] += 1
+                totals[0] += 1
+
+            # both agents remember it
+            for b in (a, p):
+                if memory_len[b] == MEMORY_SIZE:
+                    memory_hostile[b] -= memory[b] >> (MEMORY_SIZE - 1)
+                else:
+                    memory_len[b] += 1
+                memory[b] = ((memory[b] << 1) | interaction) & MEMORY_MASK
+                memory_hostile[b] += interaction
+
+        # -- update_internal_state
+        grievance[a] *= decay
+        if ethnicity[a] == MAJORITY and memory_len[a]:
+            v = memory_hostile[a] / memory_len[a]
+            n = (memory_len[a] - memory_hostile[a]) / memory_len[a]
+            t = threshold[a]
+            delta = -alpha * v * t + beta * n * (1 - t)
+            threshold[a] = min(max(t + delta, 0.0), 1.0)
+
+        # -- move: to the most peaceful adjacent empty cell, or a random one
+        n_empty = 0
+        for k in range(adjacent_index.shape[1]):
+            c = adjacent_index[here, k]
+            if c >= 0 and cell_agent[c] < 0:
+                buf[n_empty] = c
+                n_empty += 1
+        if not n_empty:
+            continue
+        best = buf[0]
+        for k in range(1, n_empty):
+            if cell_hostile[buf[k]] < cell_hostile[best]:
+                best = buf[k]
+        if cell_hostile[best] >= cell_hostile[here]:
+            best = -1
+        target = -1
+        if best >= 0 and _random(movement_state) < aversion:
+            target = best
+        elif _random(movement_state) < 1 - aversion:
+            target = buf[_randbelow(movement_state, n_empty)]
+        if target >= 0:
+            cell_agent[here] = -1
+            cell_agent[target] = a
+            x[a] = target // height
+            y[a] = target % height
+
+
+@njit(cache=True)
+def stats_kernel(order, ethnicity, grievance, threshold):
+    # per-group sums in schedule order, as the agent engine adds them up
+    count = np.zeros(2, dtype=np.int64)
+    total_grievance = np.zeros(2)
+    total_threshold = np.zeros(2)
+    max_grievance = 0.0
+    for a in order:
+        e = ethnicity[a]
+        count[e] += 1
+        total_grievance[e] += grievance[a]
+        total_threshold[e] += threshold[a]
+        if grievance[a] > max_grievance:
+            max_grievance = grievance[a]
+    return count, total_grievance, total_threshold, max_grievance
+
+
+_CHECKED = None
+
+
+def available():
+    # True when Numba is installed and the replayed draws match this
+    # Python's random module (checked once per process)
+    global _CHECKED
+    if _CHECKED is None:
+        _CHECKED = HAVE_NUMBA and _matches_stdlib()
+    return _CHECKED
+
+
+def _matches_stdlib():
+    import random
+    rand = random.Random(40550)
+    state = load_state(rand)
+    seq = list(range(1000))
+    x = np.arange(1000, dtype=np.int64)
+    rand.shuffle(seq)
+    _shuffle(state, x)
+    draws = [rand.random() for _ in range(5)] + [rand.choice(range(n)) for n in (1, 3, 8, 1000)]
+    replay = [_random(state) for _ in range(5)] + [_randbelow(state, n) for n in (1, 3, 8, 1000)]
+    return seq == x.tolist() and draws == replay and load_state(rand).tolist() == state.tolist()
+
+
+class KernelEngine:
+    # Agent state as arrays for step_kernel, with the interface the model
+    # uses for its array engines (step, stats, cell_agent, x/ethnicity/...).
+
+    def __init__(self, model, population):
+        self.model  = model
+        self.width  = model.width
+        self.height = model.height
+        n = len(population)
+        self.order     = np.arange(n, dtype=np.int64)   # the agent list, shuffled in place
+        self.x         = np.array([p[0] for p, _, _, _ in population], dtype=np.int64)
+        self.y         = np.array([p[1] for p, _, _, _ in population], dtype=np.int64)
+        self.ethnicity = np.array([e for _, e, _, _ in population], dtype=np.int64)
+        self.grievance = np.array([g for _, _, g, _ in population], dtype=float)
+        self.threshold = np.array([t for _, _, _, t in population], dtype=float)
+        self.memory         = np.zeros(n, dtype=np.int64)
+        self.memory_len     = np.zeros(n, dtype=np.int64)
+        self.memory_hostile = np.zeros(n, dtype=np.int64)
+
+        cells = self.width * self.height
+        self.cell_index = np.full(cells, -1, dtype=np.int64)
+        self.cell_index[self.x * self.height + self.y] = np.arange(n)
+        # (1, width, height) view, like ArrayEngine's one-replicate grid
+        self.cell_agent = self.cell_index.reshape(1, self.width, self.height)
+        self.cell_log     = np.zeros(cells, dtype=np.int64)
+        self.cell_count   = np.zeros(cells, dtype=np.int64)
+        self.cell_hostile = np.zeros(cells, dtype=np.int64)
+        self.totals       = np.zeros(2, dtype=np.int64)
+
+    def step(self, profiler=None):
+        m = self.model
+        states = [load_state(r) for r in
+                  (m.schedule_random, m.interaction_random, m.movement_random)]
+        t = clock()
+        step_kernel(self.order, self.x, self.y, self.ethnicity, self.grievance, self.threshold,
+                    self.memory, self.memory_len, self.memory_hostile,
+                    self.cell_index, m.vision_cells.index, m.adjacent_cells.index,
+                    self.cell_log, self.cell_count, self.cell_hostile, self.totals,
+                    *states, self.height, float(m.alpha), float(m.beta), float(m.decay),
+                    float(m.aversion), m.max_cell_memory)
+        if profiler is not None:
+            profiler.add("kernel", clock() - t, len(self.order))
+            # one vision query and one move query per agent
+            profiler.queries += 2 * len(self.order)
+        for r, state in zip((m.schedule_random, m.interaction_random, m.movement_random), states):
+            store_state(r, state)
+
+    def stats(self):
+        count, grievance, threshold, max_grievance = stats_kernel(
+            self.order, self.ethnicity, self.grievance, self.threshold)
+        count, grievance, threshold = count.tolist(), grievance.tolist(), threshold.tolist()
+        hostile_total, interaction_total = self.totals.tolist()
+        return {
+            "maj_count":         count[MAJORITY],
+            "min_count":         count[MINORITY],
+            "maj_grievance":     grievance[MAJORITY] / max(1, count[MAJORITY]),
+            "min_grievance":     grievance[MINORITY] / max(1, count[MINORITY]),
+            "maj_threshold":     threshold[MAJORITY] / max(1, count[MAJORITY]),
+            "min_threshold":     threshold[MINORITY] / max(1, count[MINORITY]),
+            "max_grievance":     float(max_grievance),
+            "hostile_total":     hostile_total,
+            "interaction_total": interaction_total,
+            "hostility":         hostile_total / max(1, interaction_total),
+        }
@@ -1,69 +1,338 @@
 # model.py
 from mesa import Model
-from mesa.space import MultiGrid
 from mesa.datacollection import DataCollector
-from agents import EthnicAgent
+from agents import EthnicAgent, MAJORITY, MINORITY, HOSTILE
+from array_engine import ArrayEngine
+from kernel import KernelEngine, available as kernel_available
+from neighbourhood import neighbourhood_table
+from occupancy import IndexedMultiGrid
+from profiling import StepProfiler, clock
 from collections import deque
+import numpy as np
+import random
+import warnings
 import os
 
+ENGINES = ("agent", "array", "compiled")
+
+# independent random streams, one per purpose, all derived from the model seed
+STREAMS = ("placement", "schedule", "interaction", "movement")
+
+
+def python_random(seed_sequence):
+    # stdlib Random seeded from a SeedSequence (for the agent engine)
+    return random.Random(int(seed_sequence.generate_state(1, np.uint64)[0]))
+
+
+def seed_streams(seed):
+    # the seed's SeedSequence and one child stream per purpose in STREAMS
+    seed_sequence = np.random.SeedSequence(seed)
+    return seed_sequence, dict(zip(STREAMS, seed_sequence.spawn(len(STREAMS))))
+
+
+def draw_population(width, height, density, majority_pct, rng):
+    # initial agents as (pos, ethnicity, grievance, threshold), drawn from a
+    # stdlib Random so both engines (and batched replicates) start alike
+    total = width * height
+    n    = int(density * total)
+    pos  = [(x, y) for x in range(width) for y in range(height)]
+    rng.shuffle(pos)
+    population = []
+    for p in pos[:n]:
+        eth   = MAJORITY if rng.random() < majority_pct else MINORITY
+        g0    = rng.random() * 0.2 # grievance in [0, 0.2]
+        t0    = rng.random() * 0.8 + 0.2 # threshold in [0.2, 1.0]
+        population.append((p, eth, g0, t0))
+    return population
+
+# DataCollector column -> key of the per-step statistics snapshot
+REPORTERS = {
+    "Avg_Maj_Grievance":      "maj_grievance",
+    "Avg_Min_Grievance":      "min_grievance",
+    "Avg_Maj_Threshold":      "maj_threshold",
+    "Overall_Hosility_Level": "hostility",
+}
+
+# constructor parameters reset() accepts besides the seed
+PARAMS = ("width", "height", "majority_pct", "density", "alpha", "beta", "decay",
+          "vision", "aversion", "engine", "convergence_tol", "convergence_patience",
+          "calm_grievance", "instrument")
+
 class EthnicViolenceModel(Model):
 
     def __init__(self, width=60, height=60, majority_pct=0.7, density=0.6,
-                 alpha=0.2, beta=0.05, decay=0.8, vision=2, aversion=0.1):
-        super().__init__()
-        self.width        = width
-        self.height       = height
-        self.majority_pct = majority_pct
-        self.density      = density
-        self.alpha        = alpha
-        self.beta         = beta
-        self.decay        = decay
-        self.vision       = vision
-        self.aversion     = aversion
-
-        self.grid             = MultiGrid(width, height, torus=False)
+                 alpha=0.2, beta=0.05, decay=0.8, vision=2, aversion=0.1,
+                 engine="agent", seed=None, convergence_tol=None, convergence_patience=5,
+                 calm_grievance=None, instrument=False):
+        super().__init__(seed=seed)
+        self.grid        = None
+        self.agent_list  = []
+        # every EthnicAgent created so far, by unique_id; reset() recycles them
+        self._agent_pool = []
+
+        # all reporters read one cached snapshot per step, see stats()
+        self._stats = None
+        self.datacollector = DataCollector()
+        for name, key in REPORTERS.items():
+            self.add_reporter(name, key)
+
+        self.reset(width=width, height=height, majority_pct=majority_pct, density=density,
+                   alpha=alpha, beta=beta, decay=decay, vision=vision, aversion=aversion,
+                   engine=engine, seed=seed, convergence_tol=convergence_tol,
+                   convergence_patience=convergence_patience,
+                   calm_grievance=calm_grievance, instrument=instrument)
+
+    def reset(self, seed=None, **params):
+        # Start a new run in place, exactly as a new model built with these
+        # params (any not given keep their current value) and this seed would.
+        # The grid, agent objects and DataCollector are reused where the
+        # dimensions allow, so a sweep worker can keep one model for all tasks.
+        t_construct = clock()
+        unknown = set(params) - set(PARAMS)
+        if unknown:
+            raise TypeError(f"reset() got unexpected parameters {sorted(unknown)}")
+        engine = params.get("engine", getattr(self, "engine", "agent"))
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, got {engine!r}")
+        for name, value in params.items():
+            setattr(self, name, value)
+        if engine == "compiled" and not kernel_available():
+            # same run either way, just at Python speed
+            warnings.warn("engine='compiled' needs numba; running the agent engine instead",
+                          RuntimeWarning)
+            engine = "agent"
+        if engine == "array" and self.vision > 1:
+            # a tick needs more batches the wider the vision (~80 at vision 2,
+            # ~400 at vision 5), and a single run has nothing to spread them over
+            warnings.warn(f"engine='array' is slower than the agent and compiled engines "
+                          f"at vision {self.vision}; it pays off at vision 1 or for "
+                          "batched replicates (ReplicateBatch)", RuntimeWarning)
+        width, height = self.width, self.height
+        # per-phase timings and query counts, only when asked for
+        self.profiler     = StepProfiler() if self.instrument else None
+        self.running      = True
+        self.steps        = 0
+
+        # Split the seed into one stream per purpose, so e.g. a change in how
+        # movement consumes randomness doesn't shift interactions, and runs
+        # sharing a seed see common random numbers. self.seed records the
+        # entropy actually used, even when no seed was given.
+        self.seed_sequence, self.streams = seed_streams(seed)
+        self.seed          = self.seed_sequence.entropy
+        self.reset_randomizer(self.seed)
+        self.reset_rng(self.seed)
+        self.placement_random   = python_random(self.streams["placement"])
+        self.schedule_random    = python_random(self.streams["schedule"])
+        self.interaction_random = python_random(self.streams["interaction"])
+        self.movement_random    = python_random(self.streams["movement"])
+
+        # stop once every reporter moves by at most convergence_tol per step
+        # for convergence_patience consecutive steps, or once no agent's
+        # grievance exceeds calm_grievance (None disables either check)
+        self.converged_at         = None
+        self._calm_steps          = 0
+        self._last_reported       = None
+
+        if self.grid is not None and (self.grid.width, self.grid.height) == (width, height):
+            for agent in self.agent_list:
+                self.grid.remove_agent(agent)
+        else:
+            self.grid         = IndexedMultiGrid(width, height, torus=False)
+            for agent in self.agent_list:
+                agent.pos = None
+        # precomputed neighbour cells for interaction (vision) and moves (radius 1)
+        self.vision_cells     = neighbourhood_table(width, height, self.vision, torus=False)
+        self.adjacent_cells   = neighbourhood_table(width, height, 1, torus=False)
+        if self.profiler is not None:
+            # the tables are shared by every model in the process, so lookups
+            # are counted through views that belong to this model alone
+            self.vision_cells   = self.profiler.counting(self.vision_cells, "indices")
+            self.adjacent_cells = self.profiler.counting(self.adjacent_cells, "indices")
         self.interactions_log = {}
         self.max_cell_memory = 10 
+        # running tallies over the contents of interactions_log, kept in sync
+        # by record_interaction so reporters and movers never rescan the deques
+        self.cell_hostile      = np.zeros(width * height, dtype=np.int64)   # by flat cell
+        self.hostile_total     = 0
+        self.interaction_total = 0
         self.schedule_time    = 0
 
-        # initialize agents with random grievance & threshold
-        total = width * height
-        n    = int(density * total)
-        pos  = [(x, y) for x in range(width) for y in range(height)]
-        self.random.shuffle(pos)
-        chosen = pos[:n]
+        # initialize agents with random grievance & threshold; the population
+        # is drawn first so both engines start from the same state
+        population = draw_population(width, height, self.density, self.majority_pct,
+                                     self.placement_random)
 
         self.agent_list = []
+        self.arrays     = None
+
+        if engine == "array":
+            self.arrays = ArrayEngine(self, [population], [self.streams])
+        elif engine == "compiled":
+            self.arrays = KernelEngine(self, population)
+        else:
+            pool = self._agent_pool
+            for uid, (p, eth, g0, t0) in enumerate(population):
+                if uid < len(pool):
+                    agent = pool[uid]
+                    agent.reset(eth, g0, t0, aversion=self.aversion)
+                else:
+                    agent = EthnicAgent(uid, self, eth, g0, t0, aversion=self.aversion)
+                    pool.append(agent)
+                self.grid.place_agent(agent, p)
+                self.agent_list.append(agent)
+
+        # keep the reporters, drop the previous run's rows
+        self._stats = None
+        for name in self.datacollector.model_vars:
+            self.datacollector.model_vars[name] = []
 
-        for uid, p in enumerate(chosen):
-            eth   = "majority" if self.random.random() < majority_pct else "minority"
-            g0    = self.random.random() * 0.2 # grievance in [0, 0.2]
-            t0    = self.random.random() * 0.8 + 0.2 # threshold in [0.2, 1.0]
-            agent = EthnicAgent(uid, self, eth, g0, t0, aversion=self.aversion)
-            self.grid.place_agent(agent, p)
-            self.agent_list.append(agent)
-
-        self.datacollector = DataCollector(model_reporters={
-            "Avg_Maj_Grievance":   lambda m: sum(a.grievance    for a in m.agent_list if a.ethnicity=="majority")
-                                      / max(1, sum(1 for a in m.agent_list if a.ethnicity=="majority")),
-            "Avg_Min_Grievance":   lambda m: sum(a.grievance    for a in m.agent_list if a.ethnicity=="minority")
-                                      / max(1, sum(1 for a in m.agent_list if a.ethnicity=="minority")),
-            "Avg_Maj_Threshold":   lambda m: sum(a.violence_threshold for a in m.agent_list if a.ethnicity=="majority")
-                                      / max(1, sum(1 for a in m.agent_list if a.ethnicity=="majority")),
-            "Overall_Hosility_Level": lambda m: (
-                                        sum(i == "hostile" for logs in m.interactions_log.values() for i in logs) /
-                                        max(1, sum(len(logs) for logs in m.interactions_log.values()))
-                                    )
-        })
+        if self.profiler is not None:
+            self.profiler.construct_time = clock() - t_construct
 
     def step(self):
+        if self.profiler is not None:
+            self._profiled_step()
+        else:
+            self.datacollector.collect(self)
+            if self.arrays is not None:
+                self.arrays.step()
+            else:
+                self.schedule_random.shuffle(self.agent_list)
+                for a in self.agent_list:
+                    a.step()
+        self._stats = None
+        self.schedule_time += 1
+        if self.convergence_tol is not None or self.calm_grievance is not None:
+            self._check_convergence()
+        if self.profiler is not None:
+            self.profiler.end_step()
+
+    def _profiled_step(self):
+        # same work as step(), with every phase timed
+        p = self.profiler
+        t = clock()
         self.datacollector.collect(self)
-        self.random.shuffle(self.agent_list)
+        p.add("collect", clock() - t)
+        if self.arrays is not None:
+            self.arrays.step(profiler=p)
+            return
+
+        t = clock()
+        self.schedule_random.shuffle(self.agent_list)
+        p.add("schedule", clock() - t)
+        # neighbourhood lookups are counted by the views set up in reset()
+        t_interact = t_update = t_move = 0.0
         for a in self.agent_list:
-            a.step()
-        self.schedule_time += 1
+            t0 = clock()
+            a.interact()
+            t1 = clock()
+            a.update_internal_state()
+            t2 = clock()
+            a.move()
+            t3 = clock()
+            t_interact += t1 - t0
+            t_update   += t2 - t1
+            t_move     += t3 - t2
+        n = len(self.agent_list)
+        p.add("interact", t_interact, n)
+        p.add("update_internal_state", t_update, n)
+        p.add("move", t_move, n)
+
+    def _check_convergence(self):
+        stats = self.stats()
+        if self.calm_grievance is not None and stats["max_grievance"] <= self.calm_grievance:
+            self.running      = False
+            self.converged_at = self.schedule_time
+            return
+        if self.convergence_tol is None:
+            return
+        values = [stats[key] for key in REPORTERS.values()]
+        if self._last_reported is not None and all(
+            abs(v - last) <= self.convergence_tol for v, last in zip(values, self._last_reported)
+        ):
+            self._calm_steps += 1
+        else:
+            self._calm_steps = 0
+        self._last_reported = values
+        if self._calm_steps >= self.convergence_patience:
+            self.running      = False
+            self.converged_at = self.schedule_time
+
+    def stats(self):
+        # group aggregates for the current state, computed once and cached
+        # until the next step changes it
+        if self._stats is None:
+            if self.arrays is not None:
+                self._stats = self.arrays.stats()
+            else:
+                self._stats = self._agent_stats()
+        return self._stats
+
+    def _agent_stats(self):
+        count     = [0, 0]
+        grievance = [0.0, 0.0]
+        threshold = [0.0, 0.0]
+        max_grievance = 0.0
+        for a in self.agent_list:
+            count[a.ethnicity]     += 1
+            grievance[a.ethnicity] += a.grievance
+            threshold[a.ethnicity] += a.violence_threshold
+            if a.grievance > max_grievance:
+                max_grievance = a.grievance
+        return {
+            "maj_count":         count[MAJORITY],
+            "min_count":         count[MINORITY],
+            "maj_grievance":     grievance[MAJORITY] / max(1, count[MAJORITY]),
+            "min_grievance":     grievance[MINORITY] / max(1, count[MINORITY]),
+            "maj_threshold":     threshold[MAJORITY] / max(1, count[MAJORITY]),
+            "min_threshold":     threshold[MINORITY] / max(1, count[MINORITY]),
+            "max_grievance":     max_grievance,
+            "hostile_total":     self.hostile_total,
+            "interaction_total": self.interaction_total,
+            "hostility":         self.hostile_total / max(1, self.interaction_total),
+        }
+
+    def grid_layers(self):
+        # per-cell state for recording.Recorder: ethnicity (-1 empty) and
+        # grievance (NaN empty) as (width, height) arrays
+        shape = (self.width, self.height)
+        if self.arrays is not None:
+            ids = self.arrays.cell_agent[0]
+            occupied = ids >= 0
+            ethnicity = np.where(occupied, self.arrays.ethnicity[ids], -1).astype(np.int8)
+            grievance = np.where(occupied, self.arrays.grievance[ids], np.nan).astype(np.float32)
+            return {"ethnicity": ethnicity, "grievance": grievance}
+        occupied = self.grid.occupied
+        ids = self.grid.cell_agent[occupied]
+        grievance = np.full(self.width * self.height, np.nan, dtype=np.float32)
+        grievance[occupied] = [self._agent_pool[i].grievance for i in ids]
+        return {"ethnicity": self.grid.cell_ethnicity.reshape(shape).copy(),
+                "grievance": grievance.reshape(shape)}
+
+    def add_reporter(self, name, reporter):
+        # collect a column from the shared snapshot: `reporter` is either a
+        # snapshot key or a function of the snapshot dict
+        if isinstance(reporter, str):
+            key = reporter
+            reporter = lambda stats: stats[key]
+        dc = self.datacollector
+        dc.model_reporters[name] = lambda m: reporter(m.stats())
+        # steps collected before registration have no value for this column
+        collected = max((len(v) for v in dc.model_vars.values()), default=0)
+        dc.model_vars[name] = [None] * collected
 
     def record_interaction(self, interaction, pos):
-        if pos not in self.interactions_log:
-            self.interactions_log[pos] = deque(maxlen=self.max_cell_memory)
-        self.interactions_log[pos].append(interaction)
+        log = self.interactions_log.get(pos)
+        if log is None:
+            log = self.interactions_log[pos] = deque(maxlen=self.max_cell_memory)
+        elif len(log) == log.maxlen:
+            # the append below evicts the oldest entry
+            if log[0] == HOSTILE:
+                self.cell_hostile[pos[0] * self.height + pos[1]] -= 1
+                self.hostile_total     -= 1
+            self.interaction_total -= 1
+        log.append(interaction)
+        self.interaction_total += 1
+        if interaction == HOSTILE:
+            self.cell_hostile[pos[0] * self.height + pos[1]] += 1
+            self.hostile_total    += 1
@@ -0,0 +1,61 @@
+# neighbourhood.py
+# Precomputed neighbourhood tables. One table per (radius, moore, torus, grid
+# shape) holds, for every cell, the flat indices of its neighbours in the same
+# order as Mesa's get_neighborhood, with a mask for cells clipped at the edge
+# of a non-torus grid (or repeated when a torus window wraps onto itself).
+# Tables are shared by every model in the process that asks for the same one.
+import functools
+import numpy as np
+
+# A 300x300 radius-5 table takes ~100 MB, so only the most recently used few
+# are kept for reuse; a model holds on to its own tables while it runs.
+CACHED_TABLES = 4
+
+
+@functools.lru_cache(maxsize=CACHED_TABLES)
+def neighbourhood_table(width, height, radius, moore=True, torus=False):
+    return NeighbourhoodTable(width, height, radius, moore, torus)
+
+
+class NeighbourhoodTable:
+
+    def __init__(self, width, height, radius, moore=True, torus=False):
+        self.width  = width
+        self.height = height
+        self.radius = radius
+        self.moore  = moore
+        self.torus  = torus
+
+        # offsets with x outer, y inner, like get_neighborhood
+        r = range(-radius, radius + 1)
+        self.offsets = np.array([(dx, dy) for dx in r for dy in r
+                                 if moore or abs(dx) + abs(dy) <= radius])
+
+        cells = np.arange(width * height)
+        xs, ys = np.divmod(cells, height)
+        nx = xs[:, None] + self.offsets[:, 0]
+        ny = ys[:, None] + self.offsets[:, 1]
+        if torus:
+            nx %= width
+            ny %= height
+            mask = np.ones(nx.shape, dtype=bool)
+        else:
+            mask = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+        index = np.where(mask, nx * height + ny, -1)
+        # the center is never a neighbour, even when the window wraps onto it
+        mask &= index != cells[:, None]
+        if torus and 2 * radius + 1 > min(width, height):
+            # keep only the first occurrence of a wrapped cell
+            for c in cells:
+                _, first = np.unique(index[c], return_index=True)
+                keep = np.zeros(len(self.offsets), dtype=bool)
+                keep[first] = True
+                mask[c] &= keep
+        self.index = np.where(mask, index, -1)
+        self.mask  = mask
+
+    def indices(self, pos):
+        # flat indices (x * height + y) of the neighbours of pos
+        c = pos[0] * self.height + pos[1]
+        return self.index[c][self.mask[c]]
+
@@ -0,0 +1,68 @@
+# occupancy.py
+# MultiGrid with a dense occupancy index kept in sync by place_agent and
+# remove_agent (and so by move_agent). Cells are flat indices x * height + y,
+# matching NeighbourhoodTable, so neighbourhood queries become array masks:
+#   cell_agent[c]      unique_id of the agent in cell c, -1 when empty
+#   occupied[c]        boolean occupancy mask
+#   cell_ethnicity[c]  ethnicity code of that agent, -1 when empty
+#   agent_at[c]        the agent object itself (None when empty)
+# The model never stacks agents, so the index holds at most one per cell.
+import numpy as np
+from mesa.space import MultiGrid
+
+
+class IndexedMultiGrid(MultiGrid):
+
+    def __init__(self, width, height, torus=False):
+        super().__init__(width, height, torus)
+        cells = width * height
+        self.cell_agent     = np.full(cells, -1, dtype=np.int64)
+        self.occupied       = np.zeros(cells, dtype=bool)
+        self.cell_ethnicity = np.full(cells, -1, dtype=np.int8)
+        self.agent_at       = [None] * cells
+
+    def cell(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    def place_agent(self, agent, pos):
+        c = self.cell(pos)
+        if self.occupied[c]:
+            raise ValueError(f"cell {pos} is already occupied; the occupancy index "
+                             "holds one agent per cell")
+        super().place_agent(agent, pos)
+        self.cell_agent[c]     = agent.unique_id
+        self.occupied[c]       = True
+        self.cell_ethnicity[c] = agent.ethnicity
+        self.agent_at[c]       = agent
+
+    def remove_agent(self, agent):
+        c = self.cell(agent.pos)
+        super().remove_agent(agent)
+        self.cell_agent[c]     = -1
+        self.occupied[c]       = False
+        self.cell_ethnicity[c] = -1
+        self.agent_at[c]       = None
+
+    def out_group_cells(self, cells, ethnicity):
+        # the cells among `cells` holding an agent of another ethnicity, in order
+        eth = self.cell_ethnicity[cells]
+        return cells[(eth >= 0) & (eth != ethnicity)]
+
+    def empty_cells(self, cells):
+        return cells[~self.occupied[cells]]
+
+    def sample_out_group(self, table, u):
+        # One out-group partner for every occupied cell at once. `table` is the
+        # NeighbourhoodTable to search and u one uniform draw per occupied cell
+        # (in cell order); returns (cells, partner cells), -1 where a cell has
+        # no out-group neighbour. The pick is uniform over the out-group
+        # neighbours, like random.choice over the neighbourhood in order.
+        cells = np.flatnonzero(self.occupied)
+        nbrs  = table.index[cells]
+        eth   = np.where(table.mask[cells], self.cell_ethnicity[nbrs], -1)
+        out   = (eth >= 0) & (eth != self.cell_ethnicity[cells][:, None])
+        count = out.sum(axis=1)
+        k = np.floor(np.asarray(u) * count).astype(np.int64)
+        hit = out & (np.cumsum(out, axis=1) - 1 == k[:, None])
+        partner = np.where(count > 0, nbrs[np.arange(len(cells)), hit.argmax(axis=1)], -1)
+        return cells, partner
@@ -0,0 +1,78 @@
+# profiling.py
+# Opt-in instrumentation for model steps: wall time and call counts per phase
+# plus neighbourhood-query counts, recorded per step. Models only touch this
+# when constructed with instrument=True, so the normal step path is unchanged.
+import time
+from collections import defaultdict
+
+clock = time.perf_counter
+
+
+class StepProfiler:
+
+    def __init__(self):
+        self.time    = defaultdict(float)   # phase -> seconds, current step
+        self.calls   = defaultdict(int)     # phase -> calls, current step
+        self.queries = 0                    # neighbourhood queries, current step
+        self.steps   = []                   # one record per finished step
+        self.construct_time = 0.0
+
+    def add(self, phase, seconds, calls=1):
+        self.time[phase]  += seconds
+        self.calls[phase] += calls
+
+    def count_queries(self, fn):
+        # wrap a grid method so every call is counted
+        def counted(*args, **kwargs):
+            self.queries += 1
+            return fn(*args, **kwargs)
+        return counted
+
+    def counting(self, target, *methods):
+        # a view of `target` whose `methods` count every call on this profiler;
+        # models keep the view for themselves and never patch shared objects
+        return CountingView(target, {name: self.count_queries(getattr(target, name))
+                                     for name in methods})
+
+    def end_step(self):
+        self.steps.append({
+            "time":    dict(self.time),
+            "calls":   dict(self.calls),
+            "queries": self.queries,
+        })
+        self.time    = defaultdict(float)
+        self.calls   = defaultdict(int)
+        self.queries = 0
+
+    def summary(self):
+        # totals over all recorded steps, plus per-step means
+        time_total  = defaultdict(float)
+        calls_total = defaultdict(int)
+        queries = 0
+        for record in self.steps:
+            for phase, seconds in record["time"].items():
+                time_total[phase] += seconds
+            for phase, n in record["calls"].items():
+                calls_total[phase] += n
+            queries += record["queries"]
+        n_steps = max(1, len(self.steps))
+        return {
+            "steps":             len(self.steps),
+            "construct_s":       self.construct_time,
+            "phase_s":           dict(time_total),
+            "phase_calls":       dict(calls_total),
+            "phase_s_per_step":  {k: v / n_steps for k, v in time_total.items()},
+            "neighbour_queries": queries,
+            "queries_per_step":  queries / n_steps,
+        }
+
+
+class CountingView:
+
+    def __init__(self, target, methods):
+        self._target = target
+        self.__dict__.update(methods)
+
+    def __getattr__(self, name):
+        # everything not counted comes straight from the target
+        return getattr(self._target, name)
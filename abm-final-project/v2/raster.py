@@ -0,0 +1,50 @@
+# raster.py
+# SolaraViz space component that draws the grid as a single RGB image built
+# straight from the model's per-cell arrays (model.grid_layers()), instead of
+# one matplotlib marker per agent. Cost grows with the grid's pixels, not its
+# agents, so 300x300 grids redraw in milliseconds; pair it with SolaraViz's
+# render_interval to advance several steps per redraw.
+import io
+import numpy as np
+
+WHITE = (1.0, 1.0, 1.0)
+
+
+def categorical(codes, colors, shade=None, empty=WHITE, floor=0.35):
+    # (W, H) codes (-1 empty) -> (W, H, 3) RGB in [0, 1]. colors maps a code to
+    # an RGB triple; with `shade` (values in [0, 1], e.g. grievance) each cell
+    # is blended from pale (0) to its full color (1).
+    rgb = np.empty(codes.shape + (3,))
+    rgb[:] = empty
+    for code, color in colors.items():
+        rgb[codes == code] = color
+    if shade is not None:
+        s = floor + (1 - floor) * np.clip(np.nan_to_num(shade), 0, 1)[..., None]
+        occupied = (codes >= 0)[..., None]
+        rgb = np.where(occupied, np.asarray(empty) * (1 - s) + rgb * s, rgb)
+    return rgb
+
+
+def to_png(rgb, min_pixels=600):
+    # (W, H, 3) grid colors -> PNG bytes, x to the right and y up as in the
+    # matplotlib space view, each cell scaled up to at least min_pixels overall
+    from matplotlib.image import imsave
+    image = np.flipud(np.asarray(rgb).transpose(1, 0, 2))
+    scale = max(1, -(-min_pixels // max(image.shape[:2])))
+    image = image.repeat(scale, axis=0).repeat(scale, axis=1)
+    buf = io.BytesIO()
+    imsave(buf, (np.clip(image, 0, 1) * 255).astype(np.uint8), format="png")
+    return buf.getvalue()
+
+
+def make_raster_component(colorize, min_pixels=600):
+    # colorize(layers) -> (W, H, 3) RGB, where layers is model.grid_layers()
+    import solara
+    from mesa.visualization.utils import update_counter
+
+    @solara.component
+    def RasterSpace(model):
+        update_counter.get()
+        return solara.Image(to_png(colorize(model.grid_layers()), min_pixels))
+
+    return RasterSpace
@@ -0,0 +1,241 @@
+# recording.py
+# Stream a model run to disk frame by frame, and replay it later without
+# re-simulating. A recording is a directory:
+#   meta.json           grid size, layers, chunk size, model params, frame count
+#   frames-000000.npz   `chunk_size` frames, compressed, one (n, W, H) array per layer
+#   reporters.csv       the model's reporter values for every frame
+# The model supplies grid_layers() -> {name: (W, H) array}; the first layer is
+# the occupancy layer, where -1 marks an empty cell. Only one chunk of frames
+# is held in memory, on either side, and a run that dies loses at most the
+# frames of its unfinished chunk.
+#
+# Record headless (e.g. on the cluster), then replay locally:
+#   python recording.py run_300 --steps 500 --param width=300 --param height=300
+#   REPLAY=run_300 solara run app.py
+import os
+import json
+import argparse
+import importlib
+import numpy as np
+import pandas as pd
+from mesa import Agent, Model
+from mesa.space import MultiGrid
+from mesa.datacollection import DataCollector
+
+DEFAULT_MODEL = "model:EthnicViolenceModel"
+CHUNK_SIZE = 50
+
+
+def reporter_values(model):
+    # current value of every DataCollector model reporter
+    values = {}
+    for name, reporter in model.datacollector.model_reporters.items():
+        values[name] = getattr(model, reporter) if isinstance(reporter, str) else reporter(model)
+    return values
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+class Recorder:
+
+    def __init__(self, path, model, chunk_size=CHUNK_SIZE, params=None):
+        self.path       = path
+        self.model      = model
+        self.chunk_size = chunk_size
+        self.frames     = 0
+        self.buffer     = []
+        self.rows       = []
+        os.makedirs(path, exist_ok=True)
+        layers = model.grid_layers()
+        self.meta = {
+            "width":      model.width,
+            "height":     model.height,
+            "layers":     {name: str(a.dtype) for name, a in layers.items()},
+            "chunk_size": chunk_size,
+            "params":     params or {},
+            "frames":     0,
+        }
+        reporters = os.path.join(path, "reporters.csv")
+        if os.path.exists(reporters):
+            os.remove(reporters)
+        _write_json(os.path.join(path, "meta.json"), self.meta)
+
+    def record(self):
+        # one frame: the grid layers and reporter values of the current state
+        self.buffer.append(self.model.grid_layers())
+        self.rows.append(reporter_values(self.model))
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        # write the buffered frames as the next chunk; only the last chunk of
+        # a recording may be short, so this is called on full chunks and close()
+        if not self.buffer:
+            return
+        chunk = self.frames // self.chunk_size
+        name = os.path.join(self.path, f"frames-{chunk:06d}.npz")
+        stacked = {k: np.stack([frame[k] for frame in self.buffer]) for k in self.meta["layers"]}
+        with open(name + ".tmp", "wb") as f:
+            np.savez_compressed(f, **stacked)
+        os.replace(name + ".tmp", name)
+
+        reporters = os.path.join(self.path, "reporters.csv")
+        pd.DataFrame(self.rows).to_csv(reporters, mode="a", index=False,
+                                       header=not os.path.exists(reporters))
+        # meta.json is rewritten last, so a reader never sees a frame count
+        # ahead of the chunks on disk
+        self.frames += len(self.buffer)
+        self.meta["frames"] = self.frames
+        _write_json(os.path.join(self.path, "meta.json"), self.meta)
+        self.buffer = []
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def record_run(model, path, steps, chunk_size=CHUNK_SIZE, params=None):
+    # record the initial state and every step after it
+    with Recorder(path, model, chunk_size, params) as recorder:
+        recorder.record()
+        for _ in range(steps):
+            if not model.running:
+                break
+            model.step()
+            recorder.record()
+    return recorder.frames
+
+
+class Recording:
+    # lazy reader: frames are loaded a chunk at a time
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self._chunk = None
+        self._chunk_id = None
+        self._reporters = None
+
+    def __len__(self):
+        return self.meta["frames"]
+
+    def frame(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(f"frame {i} out of range for {len(self)} frames")
+        chunk, offset = divmod(i, self.meta["chunk_size"])
+        if chunk != self._chunk_id:
+            with np.load(os.path.join(self.path, f"frames-{chunk:06d}.npz")) as data:
+                self._chunk = {k: data[k] for k in data.files}
+            self._chunk_id = chunk
+        return {k: v[offset] for k, v in self._chunk.items()}
+
+    def reporters(self):
+        if self._reporters is None:
+            self._reporters = pd.read_csv(os.path.join(self.path, "reporters.csv"))
+        return self._reporters
+
+
+class FrameAgent(Agent):
+    # stand-in agent for replays; carries one attribute per recorded layer
+    pass
+
+
+class ReplayModel(Model):
+    # Plays a recording back through the usual viz components: each step
+    # shows the next frame on the grid as FrameAgents (recycled between
+    # frames) and adds that frame's reporter row to the DataCollector.
+    # Raster views read grid_layers() instead, so agents=False skips placing
+    # the stand-ins altogether.
+
+    def __init__(self, path, frame=0, agents=True):
+        super().__init__()
+        self.recording = Recording(path)
+        meta = self.recording.meta
+        self.width  = meta["width"]
+        self.height = meta["height"]
+        self.layers = list(meta["layers"])
+        self.grid   = MultiGrid(self.width, self.height, torus=False)
+        self.frame  = min(int(frame), len(self.recording) - 1)
+        self._pool  = []
+        self._shown = 0
+        self.show_agents = agents
+
+        rows = self.recording.reporters()
+        self.datacollector = DataCollector(model_reporters={
+            name: (lambda m, name=name: m.row[name]) for name in rows.columns})
+        # the plots start with the history up to the first frame shown
+        for name in rows.columns:
+            self.datacollector.model_vars[name] = rows[name].iloc[:self.frame].tolist()
+        self._show(self.frame)
+
+    @property
+    def row(self):
+        return self.recording.reporters().iloc[self.frame]
+
+    def _show(self, i):
+        if not self.show_agents:
+            self.datacollector.collect(self)
+            return
+        layers = self.recording.frame(i)
+        occupancy = layers[self.layers[0]]
+        xs, ys = np.nonzero(occupancy >= 0)
+        for agent in self._pool[:self._shown]:
+            self.grid.remove_agent(agent)
+        while len(self._pool) < len(xs):
+            self._pool.append(FrameAgent(self))
+        values = {name: layers[name][xs, ys].tolist() for name in self.layers}
+        for k, pos in enumerate(zip(xs.tolist(), ys.tolist())):
+            agent = self._pool[k]
+            for name in self.layers:
+                setattr(agent, name, values[name][k])
+            self.grid.place_agent(agent, pos)
+        self._shown = len(xs)
+        self.datacollector.collect(self)
+
+    def grid_layers(self):
+        # the frame on show, for raster views
+        return self.recording.frame(self.frame)
+
+    def step(self):
+        if self.frame + 1 >= len(self.recording):
+            self.running = False
+            return
+        self.frame += 1
+        self._show(self.frame)
+
+
+def _parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a model run to disk for replay")
+    parser.add_argument("path", help="recording directory to create")
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="module:Class to run")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="model parameter, repeatable; values are parsed as JSON")
+    args = parser.parse_args()
+
+    params = dict(p.split("=", 1) for p in args.param)
+    params = {k: _parse_value(v) for k, v in params.items()}
+    module, cls = args.model.split(":")
+    model = getattr(importlib.import_module(module), cls)(**params)
+    frames = record_run(model, args.path, args.steps, args.chunk_size, params)
+    print(f"recorded {frames} frames to {args.path}")
@@ -0,0 +1,105 @@
+# replicates.py
+# Batched replicates: R seeds of one parameter point advanced together by a
+# single ArrayEngine, one vectorized step for all of them. Replicate r follows
+# exactly the run EthnicViolenceModel(engine="array", seed=seeds[r]) would,
+# including its convergence stop; finished replicates are dropped from the
+# arrays so the rest keep stepping without them.
+import numpy as np
+import pandas as pd
+from array_engine import ArrayEngine
+from model import REPORTERS, seed_streams, python_random, draw_population
+
+
+class ReplicateBatch:
+
+    def __init__(self, seeds, width=60, height=60, majority_pct=0.7, density=0.6,
+                 alpha=0.2, beta=0.05, decay=0.8, vision=2, aversion=0.1,
+                 convergence_tol=None, convergence_patience=5, calm_grievance=None):
+        self.width        = width
+        self.height       = height
+        self.alpha        = alpha
+        self.beta         = beta
+        self.decay        = decay
+        self.vision       = vision
+        self.aversion     = aversion
+        self.max_cell_memory      = 10
+        self.convergence_tol      = convergence_tol
+        self.convergence_patience = convergence_patience
+        self.calm_grievance       = calm_grievance
+
+        populations, streams, entropy = [], [], []
+        for seed in seeds:
+            seed_sequence, s = seed_streams(seed)
+            populations.append(draw_population(width, height, density, majority_pct,
+                                               python_random(s["placement"])))
+            streams.append(s)
+            entropy.append(seed_sequence.entropy)
+        self.seeds  = entropy
+        self.arrays = ArrayEngine(self, populations, streams)
+
+        R = len(seeds)
+        # replicate ids still stepping, in engine order
+        self.active        = np.arange(R)
+        self.step_count    = np.zeros(R, dtype=np.int64)
+        self.converged_at  = np.full(R, -1, dtype=np.int64)
+        self._calm_steps   = np.zeros(R, dtype=np.int64)
+        self._last         = None
+        # reporters as collected at the start of each replicate's latest step,
+        # like the last DataCollector row of a single run
+        self.final = {name: np.full(R, np.nan) for name in REPORTERS}
+        self._stats = self.arrays.replicate_stats()
+
+    @property
+    def running(self):
+        return len(self.active) > 0
+
+    def step(self):
+        if not self.running:
+            return
+        for name, key in REPORTERS.items():
+            self.final[name][self.active] = self._stats[key]
+        self.arrays.step()
+        self.step_count[self.active] += 1
+        self._stats = self.arrays.replicate_stats()
+        if self.convergence_tol is not None or self.calm_grievance is not None:
+            self._check_convergence()
+
+    def _check_convergence(self):
+        # EthnicViolenceModel._check_convergence, per replicate
+        stats = self._stats
+        done = np.zeros(len(self.active), dtype=bool)
+        if self.calm_grievance is not None:
+            done |= stats["max_grievance"] <= self.calm_grievance
+        if self.convergence_tol is not None:
+            values = np.stack([stats[key] for key in REPORTERS.values()])
+            if self._last is not None:
+                still = (np.abs(values - self._last) <= self.convergence_tol).all(axis=0)
+                calm = self._calm_steps[self.active]
+                self._calm_steps[self.active] = np.where(still, calm + 1, 0)
+            self._last = values
+            done |= self._calm_steps[self.active] >= self.convergence_patience
+        if not done.any():
+            return
+        finished = self.active[done]
+        self.converged_at[finished] = self.step_count[finished]
+        self.active = self.active[~done]
+        self.arrays.keep_replicates(~done)
+        self._stats = {k: v[~done] for k, v in stats.items()}
+        if self._last is not None:
+            self._last = self._last[:, ~done]
+
+    def run(self, max_steps):
+        while self.running and self.step_count[self.active].max() < max_steps:
+            self.step()
+        return self.results()
+
+    def results(self):
+        # one row per replicate with the single-run result columns
+        df = pd.DataFrame({
+            "seed":       self.seeds,
+            "step_count": self.step_count,
+            **self.final,
+        })
+        df["converged_at"] = pd.Series(self.converged_at, dtype="Int64").mask(
+            self.converged_at < 0)
+        return df
@@ -0,0 +1,163 @@
+# scheduling.py
+# Cost-aware dispatch of sweep tasks to a process pool. Tasks are sent
+# longest-first (by a runtime estimate refined from the runtimes seen so far)
+# so slow corners of the grid start early instead of straggling at the tail,
+# and cheap tasks travel in chunks to cut IPC. Only a couple of chunks per
+# worker are queued at any time, so re-estimates apply to everything not yet
+# sent. Every task is timed in its worker, which gives the utilization report.
+import os
+import time
+import queue
+import numpy as np
+
+
+def _timed_chunk(fn, items):
+    # worker side: fn over a chunk, with wall-clock (start, end) per item so
+    # intervals from different workers line up
+    out = []
+    for item in items:
+        t0 = time.time()
+        res = fn(item)
+        out.append((res, t0, time.time()))
+    return os.getpid(), out
+
+
+class CostModel:
+    # Runtime estimate per task. features(task) returns numbers, the first a
+    # prior cost (e.g. agents x neighbourhood cells). Until min_observations
+    # runtimes are in, tasks are ranked by the prior alone; after that log
+    # runtime is fitted by ridge regression on [1, log prior, other features],
+    # refitted each time the number of observations doubles.
+
+    def __init__(self, features, min_observations=8, ridge=1e-3):
+        self.features         = features
+        self.min_observations = min_observations
+        self.ridge            = ridge
+        self.X       = []
+        self.y       = []
+        self.weights = None
+        self._next_fit = min_observations
+
+    def _design(self, rows):
+        rows = np.asarray(rows, dtype=float).reshape(len(rows), -1)
+        return np.column_stack([np.ones(len(rows)), np.log(np.maximum(rows[:, 0], 1e-12)),
+                                rows[:, 1:]])
+
+    def observe(self, task, seconds):
+        # returns True when this observation refitted the model
+        self.X.append(self.features(task))
+        self.y.append(np.log(max(seconds, 1e-6)))
+        if len(self.y) < self._next_fit:
+            return False
+        X = self._design(self.X)
+        A = X.T @ X + self.ridge * np.eye(X.shape[1])
+        self.weights = np.linalg.solve(A, X.T @ np.asarray(self.y))
+        self._next_fit = 2 * len(self.y)
+        return True
+
+    def estimate(self, tasks):
+        rows = [self.features(t) for t in tasks]
+        if not rows:
+            return np.zeros(0)
+        if self.weights is None:
+            return np.asarray(rows, dtype=float).reshape(len(rows), -1)[:, 0]
+        return np.exp(self._design(rows) @ self.weights)
+
+
+class Scheduler:
+    # Runs fn over tasks on `pool` and yields the results as they finish.
+    # With a cost model, tasks go longest-first and are grouped into chunks of
+    # about remaining cost / (processes * chunks_per_worker); without one they
+    # go in the given order, one per chunk, like imap_unordered(chunksize=1).
+
+    def __init__(self, pool, fn, processes, cost=None, in_flight=2,
+                 chunks_per_worker=4, max_chunk=64):
+        self.pool      = pool
+        self.fn        = fn
+        self.processes = processes
+        self.cost      = cost
+        self.in_flight = in_flight
+        self.chunks_per_worker = chunks_per_worker
+        self.max_chunk = max_chunk
+        self.intervals = []      # (pid, start, end) per task
+        self.chunks    = 0
+        self.last_dispatch = None
+
+    def _rank(self, tasks):
+        # remaining tasks and their estimates, cheapest first (popped from the end)
+        if self.cost is None:
+            return list(reversed(tasks)), np.ones(len(tasks))
+        est = self.cost.estimate(tasks)
+        order = np.argsort(est, kind="stable")
+        return [tasks[i] for i in order], est[order]
+
+    def run(self, tasks):
+        remaining, est = self._rank(list(tasks))
+        est = est.tolist()
+        left = sum(est)
+        done = queue.Queue()
+        pending = 0
+
+        def dispatch():
+            nonlocal left
+            if self.cost is None:
+                chunk = [remaining.pop()]
+                est.pop()
+            else:
+                target = left / (self.processes * self.chunks_per_worker)
+                chunk, cost = [], 0.0
+                while remaining and len(chunk) < self.max_chunk and (not chunk or cost < target):
+                    chunk.append(remaining.pop())
+                    cost += est.pop()
+                left -= cost
+            self.pool.apply_async(_timed_chunk, (self.fn, chunk),
+                                  callback=lambda out: done.put((chunk, out)),
+                                  error_callback=done.put)
+            self.chunks += 1
+            self.last_dispatch = time.time()
+
+        while remaining or pending:
+            while remaining and pending < self.processes * self.in_flight:
+                dispatch()
+                pending += 1
+            out = done.get()
+            pending -= 1
+            if isinstance(out, BaseException):
+                raise out
+            chunk, (pid, timed) = out
+            refit = False
+            for task, (res, t0, t1) in zip(chunk, timed):
+                self.intervals.append((pid, t0, t1))
+                if self.cost is not None:
+                    refit |= self.cost.observe(task, t1 - t0)
+                yield res
+            if refit and remaining:
+                remaining, new = self._rank(remaining)
+                est[:] = new.tolist()
+                left = sum(est)
+
+    def report(self):
+        # utilization: busy worker time / (processes x wall time), with wall
+        # time from the first task's start (after worker start-up) to the last
+        # finish; the tail runs from the last dispatch to that finish
+        if not self.intervals:
+            return {"tasks": 0, "chunks": self.chunks, "wall_s": 0.0, "busy_s": 0.0,
+                    "utilization": float("nan"), "tail_s": 0.0}
+        start = min(t0 for _, t0, _ in self.intervals)
+        end   = max(t1 for _, _, t1 in self.intervals)
+        wall  = end - start
+        busy = sum(t1 - t0 for _, t0, t1 in self.intervals)
+        per_worker = {}
+        for pid, t0, t1 in self.intervals:
+            per_worker[pid] = per_worker.get(pid, 0.0) + t1 - t0
+        return {
+            "tasks":       len(self.intervals),
+            "chunks":      self.chunks,
+            "workers":     len(per_worker),
+            "wall_s":      wall,
+            "busy_s":      busy,
+            "utilization": busy / (self.processes * wall) if wall > 0 else float("nan"),
+            "tail_s":      max(0.0, end - max(self.last_dispatch, start)),
+            "worker_busy_min_s": min(per_worker.values()),
+            "worker_busy_max_s": max(per_worker.values()),
+        }
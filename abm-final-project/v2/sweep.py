@@ -0,0 +1,438 @@
+# sweep.py
+# Helpers for long parameter sweeps: stable task keys, append-only chunked
+# results stores that let an interrupted sweep resume where it stopped, and a
+# result cache that lets overlapping sweeps skip runs already done.
+import hashlib
+import json
+import os
+import time
+import uuid
+import sqlite3
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+
+# parameters used as directory partitions in Parquet output
+PARTITION_COLS = ("alpha", "decay", "aversion")
+
+
+def available_cpus():
+    # CPUs actually allocated to this process (SLURM cgroup / affinity mask)
+    if os.environ.get("SLURM_CPUS_PER_TASK"):
+        return int(os.environ["SLURM_CPUS_PER_TASK"])
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def shard_tasks(tasks, index, count):
+    # deterministic round-robin split: shard `index` of `count` gets every
+    # count-th task, which also spreads slow corners of the grid across shards
+    if not 0 <= index < count:
+        raise ValueError(f"shard index {index} out of range for {count} shards")
+    return tasks[index::count]
+
+
+def merge_results(paths, output, expected=None):
+    # concatenate shard files into `output`, dropping duplicate task keys;
+    # returns (rows written, number of expected keys still missing). An
+    # existing `output` is only replaced if it has a task_key column, i.e. was
+    # written by a ResultStore or an earlier merge.
+    if os.path.exists(output) and os.path.getsize(output) > 0 and \
+            "task_key" not in pd.read_csv(output, nrows=0).columns:
+        raise ValueError(f"{output} has no task_key column, so it was not written by "
+                         "merge_results; refusing to overwrite it")
+    frames = [pd.read_csv(p) for p in paths if os.path.getsize(p) > 0]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["task_key"])
+    df = df.drop_duplicates(subset="task_key", keep="first")
+    df.to_csv(output, index=False)
+    missing = len(expected - set(df["task_key"])) if expected is not None else 0
+    return len(df), missing
+
+
+def task_seed(params, iteration, base_seed=0, common=True):
+    # Model seed for one task. With common=True every grid point shares the
+    # seed of a given iteration (common random numbers), so differences between
+    # points at the same iteration are paired comparisons; otherwise the seed
+    # also depends on the grid point.
+    payload = {"base_seed": base_seed, "iteration": iteration}
+    if not common:
+        payload["params"] = params
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    return int(digest[:15], 16)  # 60 bits: fits int64 columns
+
+
+def task_key(params, iteration):
+    # stable id of one (params, iteration) task, independent of dict ordering
+    payload = json.dumps({**params, "iteration": iteration}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def code_version(paths):
+    # hash of the source files a run's result depends on; editing any of them
+    # gives new cache keys
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        with open(path, "rb") as f:
+            digest.update(os.path.basename(path).encode() + b"\0" + f.read())
+    return digest.hexdigest()[:16]
+
+
+def _normalize(value):
+    # numbers compare by value (80 == 80.0, 0.1 + 0.2 == 0.3), not by repr
+    if isinstance(value, (bool, np.bool_)) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return round(float(value), 12)
+    return str(value)
+
+
+def result_key(params, seed, max_steps, code, **settings):
+    # content address of one run: normalized model parameters, seed, step
+    # budget, code version and any other settings that change the result
+    payload = {"params": {k: _normalize(v) for k, v in params.items()},
+               "seed": int(seed), "max_steps": int(max_steps), "code": code,
+               "settings": {k: _normalize(v) for k, v in settings.items()}}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _python_scalar(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"cannot cache a {type(value).__name__}")
+
+
+class ResultCache:
+    # Content-addressed cache of finished runs in one SQLite file, shared
+    # across sweeps: the runner looks every task up by result_key() before
+    # dispatching it and adds the runs it had to do. New entries are committed
+    # `chunk_size` at a time; once the stored results exceed max_bytes the
+    # least recently used are evicted down to 90% of it.
+
+    def __init__(self, path, max_bytes=1 << 30, chunk_size=100):
+        self.path       = path
+        self.max_bytes  = max_bytes
+        self.chunk_size = chunk_size
+        self.buffer     = []
+        # processes on one machine may share the file, waiting up to a minute
+        # for each other's locks; SQLite locking is unreliable on network file
+        # systems, so processes on different nodes must each use their own
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results ("
+                        "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self.db.commit()
+
+    def get_many(self, keys):
+        # {key: result} for the keys present; hits count as used now
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for i in range(0, len(keys), 500):   # stay under SQLite's variable limit
+            batch = keys[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            rows = self.db.execute(f"SELECT key, value FROM results WHERE key IN ({marks})", batch)
+            found.update((k, json.loads(v)) for k, v in rows)
+        if found:
+            now = time.time()
+            self.db.executemany("UPDATE results SET used = ? WHERE key = ?",
+                                [(now, k) for k in found])
+            self.db.commit()
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def add(self, key, result):
+        value = json.dumps(result, default=_python_scalar)
+        self.buffer.append((key, value, len(key) + len(value)))
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                [(k, v, size, now) for k, v, size in self.buffer])
+        self.buffer = []
+        self.evict()
+
+    def size(self):
+        # (entries, bytes of stored results)
+        n, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return n, total
+
+    def evict(self):
+        # drop least recently used entries once over max_bytes; returns how many
+        if self.size()[1] <= self.max_bytes:
+            return 0
+        with self.db:
+            deleted = self.db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM ("
+                "SELECT key, SUM(size) OVER (ORDER BY used DESC, key) AS kept FROM results) "
+                "WHERE kept > ?)", (int(0.9 * self.max_bytes),)).rowcount
+        return deleted
+
+    def merge(self, path):
+        # copy in the entries of another cache file, keeping the more recently
+        # used copy of a key; returns how many keys were new
+        self.flush()
+        self.db.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            before = self.size()[0]
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO main.results SELECT o.* FROM other.results o "
+                    "LEFT JOIN main.results r ON r.key = o.key "
+                    "WHERE r.key IS NULL OR o.used > r.used")
+            added = self.size()[0] - before
+        finally:
+            self.db.execute("DETACH DATABASE other")
+        self.evict()
+        return added
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultStore:
+    # Append-only CSV store. Results are buffered and written `chunk_size` rows
+    # at a time, each chunk flushed and fsync'ed, so at most one chunk is lost
+    # if the job is killed. The task_key column records which tasks are done.
+    # An existing file is only resumed if this store wrote it: a CSV without
+    # task_key, or rows with other columns than its header, raise ValueError
+    # rather than being mixed in. Runners call check_columns() before running
+    # anything; rows that still don't fit are saved to unwritten_path().
+
+    def __init__(self, path, chunk_size=100):
+        self.path       = path
+        self.chunk_size = chunk_size
+        self.buffer     = []
+        self.columns    = None
+        self.written    = 0
+        if os.path.exists(path):
+            self._drop_partial_line()
+            if os.path.getsize(path) > 0:
+                self.columns = list(pd.read_csv(path, nrows=0).columns)
+                if "task_key" not in self.columns:
+                    raise ValueError(f"{path} has no task_key column, so it was not written "
+                                     "by a ResultStore; refusing to append to it")
+
+    def check_columns(self, columns):
+        # raise before a run if its results could not be appended here
+        if self.columns is not None and set(columns) != set(self.columns):
+            raise ValueError(f"{self.path} has columns {self.columns}, but this run writes "
+                             f"{list(columns)}; write them to another file")
+
+    def unwritten_path(self):
+        # a prefix, so shard globs like *_shard*of*.csv never pick it up
+        head, name = os.path.split(self.path)
+        return os.path.join(head, "unwritten_" + name)
+
+    def _drop_partial_line(self):
+        # a crash mid-write can leave a row without its newline; cut it off
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if not data or data.endswith(b"\n"):
+                return
+            f.truncate(data.rfind(b"\n") + 1)
+
+    def done_keys(self):
+        if self.columns is None:
+            return set()
+        keys = pd.read_csv(self.path, usecols=["task_key"])["task_key"]
+        return set(keys.dropna())
+
+    def add(self, result):
+        # per-step trajectories only fit the Parquet store
+        result = {k: v for k, v in result.items() if k != "trajectory"}
+        self.buffer.append(result)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        df = pd.DataFrame(self.buffer)
+        header = self.columns is None
+        if header:
+            # task_key goes last so a truncated row can never carry a full key
+            self.columns = [c for c in df.columns if c != "task_key"] + ["task_key"]
+        elif set(df.columns) != set(self.columns):
+            # keep the rows, and leave nothing buffered for close() to retry
+            unwritten = self.unwritten_path()
+            df.to_csv(unwritten, mode="a", index=False, header=not os.path.exists(unwritten))
+            self.buffer = []
+            raise ValueError(f"{self.path} has columns {self.columns}, but the new rows have "
+                             f"{list(df.columns)}; they were saved to {unwritten}")
+        df = df[self.columns]
+        with open(self.path, "a", newline="") as f:
+            df.to_csv(f, header=header, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        self.written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SharedResults:
+    # Fixed-width float64 result table in shared memory, one row per task and
+    # one column per numeric output (missing values are NaN). The parent
+    # creates it; pool workers attach by name and write their row in place,
+    # so only task indices travel back through the pool.
+
+    def __init__(self, columns, rows=None, name=None):
+        self.columns = list(columns)
+        self.owner   = name is None
+        if self.owner:
+            size = max(1, rows * len(self.columns)) * 8
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            rows = self.shm.size // (8 * len(self.columns))
+        self.array = np.ndarray((rows, len(self.columns)), dtype=np.float64, buffer=self.shm.buf)
+        if self.owner:
+            self.array[:] = np.nan
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, row, values):
+        # values: mapping with the columns as keys; missing or None become NaN
+        self.array[row] = [np.nan if values.get(c) is None else values[c] for c in self.columns]
+
+    def row(self, row):
+        return dict(zip(self.columns, self.array[row].tolist()))
+
+    def frame(self):
+        # DataFrame view over the shared buffer (no copy); only valid until close()
+        return pd.DataFrame(self.array, columns=self.columns, copy=False)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet output needs pyarrow: pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+class ParquetResultStore:
+    # Same interface as ResultStore, but writes a hive-partitioned Parquet
+    # dataset under `root`:
+    #   root/final/alpha=.../decay=.../aversion=.../part-*.parquet        one row per task
+    #   root/trajectories/alpha=.../.../part-*.parquet                    one row per step
+    # Every chunk becomes new files (written to a temp name, then renamed), so
+    # several shards can share one dataset and a crash never leaves a torn file.
+
+    def __init__(self, root, chunk_size=100, partition_cols=PARTITION_COLS):
+        self.pa, self.pq    = _require_pyarrow()
+        self.root           = root
+        self.chunk_size     = chunk_size
+        self.partition_cols = list(partition_cols)
+        self.buffer         = []
+        self.trajectories   = []
+        self.written        = 0
+
+    def done_keys(self):
+        final = os.path.join(self.root, "final")
+        if not os.path.isdir(final):
+            return set()
+        keys = self.pq.read_table(final, columns=["task_key"])["task_key"]
+        return set(keys.to_pylist())
+
+    def add(self, result):
+        result = dict(result)
+        trajectory = result.pop("trajectory", None)
+        if trajectory is not None:
+            traj = trajectory.rename_axis("step").reset_index()
+            for k in self.partition_cols + ["iteration", "task_key"]:
+                traj[k] = result[k]
+            self.trajectories.append(traj)
+        self.buffer.append(result)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def _write(self, df, table_name):
+        # all-missing columns (e.g. converged_at when nothing converged) would
+        # be typed null and clash with other chunks' schema
+        df = df.astype({c: "float64" for c in df.columns if df[c].isna().all()})
+        chunk = uuid.uuid4().hex
+        for values, part in df.groupby(self.partition_cols, sort=False):
+            subdir = os.path.join(self.root, table_name, *(
+                f"{col}={val}" for col, val in zip(self.partition_cols, values)))
+            os.makedirs(subdir, exist_ok=True)
+            table = self.pa.Table.from_pandas(
+                part.drop(columns=self.partition_cols), preserve_index=False)
+            # dot-prefixed names are ignored by dataset readers until renamed
+            tmp = os.path.join(subdir, f".part-{chunk}.parquet.tmp")
+            self.pq.write_table(table, tmp)
+            os.replace(tmp, os.path.join(subdir, f"part-{chunk}.parquet"))
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self._write(pd.DataFrame(self.buffer), "final")
+        if self.trajectories:
+            self._write(pd.concat(self.trajectories, ignore_index=True), "trajectories")
+        self.written += len(self.buffer)
+        self.buffer = []
+        self.trajectories = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_results(root, table="final", filters=None, columns=None,
+                 partition_cols=PARTITION_COLS):
+    # Read a Parquet sweep back as a DataFrame, memory-mapped and filtered on
+    # the partition columns without touching other files, e.g.
+    #   load_results("sweep_results/ethnic_violence_batch_results_24000.parquet",
+    #                filters=(pc.field("alpha") == 0.2))
+    pa, _ = _require_pyarrow()
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    partitioning = ds.partitioning(
+        pa.schema([(c, pa.float64()) for c in partition_cols]), flavor="hive")
+    dataset = ds.dataset(os.path.join(root, table), format="parquet",
+                         partitioning=partitioning,
+                         filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+    return dataset.to_table(columns=columns, filter=filters).to_pandas()
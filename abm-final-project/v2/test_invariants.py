@@ -0,0 +1,344 @@
+# test_invariants.py
+# Invariants the sweep results depend on: the faster paths reproduce the
+# agent engine's runs exactly, and the sweep machinery keeps, resumes and
+# reuses results correctly. Run from this directory:
+#   python -m pytest -q test_invariants.py
+import os
+import time
+import logging
+import warnings
+import argparse
+import multiprocessing
+from collections import deque
+import numpy as np
+import pandas as pd
+import pytest
+from mesa.space import MultiGrid
+
+import kernel
+import neighbourhood
+from agents import EthnicAgent, MEMORY_SIZE
+from array_engine import bits_push
+from model import EthnicViolenceModel, REPORTERS
+from replicates import ReplicateBatch
+from sweep import ResultStore, ResultCache
+
+SMALL = {"width": 16, "height": 16, "density": 0.7, "majority_pct": 0.7,
+         "alpha": 0.3, "beta": 0.05, "decay": 0.8, "aversion": 0.2}
+
+
+def run_steps(model, steps):
+    for _ in range(steps):
+        if not model.running:
+            break
+        model.step()
+    return model
+
+
+def history(model):
+    return model.datacollector.get_model_vars_dataframe()
+
+
+@pytest.mark.filterwarnings("ignore:engine='array' is slower")
+@pytest.mark.parametrize("engine", ["agent", "compiled", "array"])
+def test_instrumented_run_matches_plain_run(engine):
+    if engine == "compiled" and not kernel.available():
+        pytest.skip("the compiled engine needs numba")
+    plain = run_steps(EthnicViolenceModel(**SMALL, vision=2, engine=engine, seed=5), 4)
+    timed = run_steps(EthnicViolenceModel(**SMALL, vision=2, engine=engine, seed=5,
+                                          instrument=True), 4)
+    assert history(timed).equals(history(plain))
+    # one vision and one adjacency lookup per agent turn
+    agents = timed.stats()["maj_count"] + timed.stats()["min_count"]
+    summary = timed.profiler.summary()
+    assert summary["steps"] == 4
+    assert summary["neighbour_queries"] == 2 * 4 * agents
+
+
+@pytest.mark.skipif(not kernel.available(), reason="the compiled engine needs numba")
+@pytest.mark.parametrize("vision", [1, 2])
+@pytest.mark.parametrize("seed", [1, 40550])
+def test_compiled_engine_matches_agent_engine(vision, seed):
+    agent    = EthnicViolenceModel(**SMALL, vision=vision, seed=seed, engine="agent")
+    compiled = EthnicViolenceModel(**SMALL, vision=vision, seed=seed, engine="compiled")
+    for _ in range(15):
+        agent.step()
+        compiled.step()
+        assert compiled.stats() == agent.stats()
+        for name, layer in agent.grid_layers().items():
+            np.testing.assert_array_equal(compiled.grid_layers()[name], layer)
+
+
+def test_array_engine_warns_beyond_vision_1():
+    with pytest.warns(RuntimeWarning, match="slower"):
+        model = EthnicViolenceModel(**SMALL, vision=2, engine="array", seed=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        model.reset(vision=1)
+        ReplicateBatch([1, 2], **SMALL, vision=2)
+
+
+@pytest.mark.parametrize("convergence_tol", [None, 1e-2])
+def test_replicate_batch_matches_single_runs(convergence_tol):
+    seeds, steps = [3, 4, 5], 12
+    settings = {"vision": 1, "convergence_tol": convergence_tol, "convergence_patience": 2}
+    batch = ReplicateBatch(seeds, **SMALL, **settings).run(steps)
+    for r, seed in enumerate(seeds):
+        model = run_steps(EthnicViolenceModel(**SMALL, **settings, engine="array", seed=seed), steps)
+        row = batch.iloc[r]
+        assert row["seed"] == model.seed
+        assert row["step_count"] == model.steps
+        final = history(model).iloc[-1]
+        for name in REPORTERS:
+            assert row[name] == final[name]
+        converged = None if pd.isna(row["converged_at"]) else row["converged_at"]
+        assert converged == model.converged_at
+
+
+@pytest.mark.filterwarnings("ignore:engine='array' is slower")
+@pytest.mark.parametrize("engine", ["agent", "compiled", "array"])
+def test_reset_matches_new_model(engine):
+    if engine == "compiled" and not kernel.available():
+        pytest.skip("the compiled engine needs numba")
+    current = {**SMALL, "vision": 2}
+    model = run_steps(EthnicViolenceModel(**current, engine=engine, seed=1), 5)
+    # parameters not passed to reset() keep their value from the run before
+    for seed, params in enumerate(({"vision": 1}, {"width": 12, "height": 20, "alpha": 0.1})):
+        current.update(params)
+        model.reset(seed=seed, **params)
+        run_steps(model, 5)
+        fresh = run_steps(EthnicViolenceModel(**current, engine=engine, seed=seed), 5)
+        pd.testing.assert_frame_equal(history(model), history(fresh))
+        for name, layer in fresh.grid_layers().items():
+            np.testing.assert_array_equal(model.grid_layers()[name], layer)
+
+
+@pytest.mark.parametrize("torus", [False, True])
+@pytest.mark.parametrize("radius", [1, 2, 5])
+def test_neighbourhood_table_matches_mesa(radius, torus):
+    grid = MultiGrid(9, 7, torus=torus)
+    table = neighbourhood.neighbourhood_table(9, 7, radius, torus=torus)
+    for _, pos in grid.coord_iter():
+        cells = [x * 7 + y for x, y in grid.get_neighborhood(pos, moore=True, radius=radius)]
+        assert table.indices(pos).tolist() == cells
+
+
+def test_neighbourhood_tables_cache_is_bounded():
+    for radius in range(1, neighbourhood.CACHED_TABLES + 3):
+        neighbourhood.neighbourhood_table(10, 10, radius)
+    assert neighbourhood.neighbourhood_table.cache_info().currsize == neighbourhood.CACHED_TABLES
+
+
+@pytest.mark.parametrize("vision", [1, 3])
+def test_sample_out_group_matches_out_group_cells(vision):
+    grid = EthnicViolenceModel(**SMALL, vision=vision, seed=2).grid
+    table = neighbourhood.neighbourhood_table(grid.width, grid.height, vision)
+    u = np.random.default_rng(0).random(grid.occupied.sum())
+    cells, partners = grid.sample_out_group(table, u)
+    assert cells.tolist() == np.flatnonzero(grid.occupied).tolist()
+    # the same pick as random.choice over the cell's out-group neighbours
+    for c, draw, partner in zip(cells.tolist(), u, partners.tolist()):
+        out = grid.out_group_cells(table.indices(divmod(c, grid.height)), grid.cell_ethnicity[c])
+        assert partner == (out[int(draw * len(out))] if len(out) else -1)
+
+
+def test_agent_memory_matches_a_deque():
+    agent = EthnicAgent(0, None, 0, 0.0, 0.5)
+    memory = deque(maxlen=MEMORY_SIZE)
+    for interaction in np.random.default_rng(1).integers(0, 2, size=40).tolist():
+        agent.remember(interaction)
+        memory.append(interaction)
+        assert agent.memory_len == len(memory)
+        assert agent.memory_hostile == sum(memory)
+        # newest outcome in bit 0
+        assert [(agent.memory >> b) & 1 for b in range(len(memory))] == list(reversed(memory))
+
+
+def test_bits_push_matches_agent_memory():
+    rng = np.random.default_rng(0)
+    owners = rng.integers(0, 20, size=300)
+    values = rng.integers(0, 2, size=300)
+    bits  = rng.integers(0, 1 << MEMORY_SIZE, size=20)
+    count = rng.integers(0, MEMORY_SIZE + 1, size=20)
+    bits[count == 0] = 0
+
+    # one agent per owner, remembering the same outcomes one at a time
+    agents = []
+    for b, c in zip(bits.tolist(), count.tolist()):
+        agent = EthnicAgent(0, None, 0, 0.0, 0.5)
+        agent.memory, agent.memory_len = b & ((1 << c) - 1), c
+        agent.memory_hostile = bin(agent.memory).count("1")
+        agents.append(agent)
+    for owner, value in zip(owners.tolist(), values.tolist()):
+        agents[owner].remember(value)
+
+    touched = bits_push(bits, count, owners, values, MEMORY_SIZE)
+    assert sorted(touched.tolist()) == sorted(set(owners.tolist()))
+    assert bits.tolist()  == [a.memory for a in agents]
+    assert count.tolist() == [a.memory_len for a in agents]
+
+
+# --- result stores and cache
+
+def results(n, start=0):
+    return [{"alpha": 0.1 * i, "iteration": i, "value": float(i), "task_key": f"k{i}"}
+            for i in range(start, start + n)]
+
+
+def test_result_store_resumes(tmp_path):
+    path = str(tmp_path / "results.csv")
+    with ResultStore(path, chunk_size=2) as store:
+        for res in results(5):
+            store.add(res)
+    # a row cut off mid-write is dropped when the store is reopened
+    with open(path, "a") as f:
+        f.write("0.5,5,5.0,k")
+    with ResultStore(path, chunk_size=2) as store:
+        assert store.done_keys() == {f"k{i}" for i in range(5)}
+        for res in results(2, start=5):
+            store.add(res)
+    df = pd.read_csv(path)
+    assert df["task_key"].tolist() == [f"k{i}" for i in range(7)]
+
+
+def test_result_store_refuses_foreign_files(tmp_path):
+    path = str(tmp_path / "foreign.csv")
+    pd.DataFrame({"alpha": [0.1], "value": [1.0]}).to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        ResultStore(path)
+
+    path = str(tmp_path / "results.csv")
+    with ResultStore(path) as store:
+        store.add(results(1)[0])
+    store = ResultStore(path)
+    store.add({**results(1, start=1)[0], "extra": 1})
+    with pytest.raises(ValueError):
+        store.flush()
+
+
+def test_result_store_keeps_rows_it_cannot_append(tmp_path):
+    path = str(tmp_path / "results.csv")
+    with ResultStore(path) as store:
+        store.add(results(1)[0])
+    with pytest.raises(ValueError) as error:
+        with ResultStore(path) as store:
+            store.check_columns(list(results(1)[0]))
+            store.add({**results(1, start=1)[0], "extra": 1})
+    # raised once, by the flush in close(), with the rows saved aside
+    assert error.value.__context__ is None
+    assert pd.read_csv(path)["task_key"].tolist() == ["k0"]
+    assert pd.read_csv(store.unwritten_path())["task_key"].tolist() == ["k1"]
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    value = {"step_count": 50, "Avg_Grievance": 0.25}
+    entry = len("key0") + len('{"step_count": 50, "Avg_Grievance": 0.25}')
+    with ResultCache(str(tmp_path / "cache.sqlite"), max_bytes=5 * entry, chunk_size=1) as cache:
+        for i in range(5):
+            cache.add(f"key{i}", value)
+            time.sleep(0.01)
+        assert cache.size() == (5, 5 * entry)
+        # key0 is used again, so key1 and key2 are now the oldest
+        assert cache.get("key0") == value
+        time.sleep(0.01)
+        cache.add("key5", value)
+        # evicted down to 90% of max_bytes: the four most recently used remain
+        assert cache.size() == (4, 4 * entry)
+        assert set(cache.get_many([f"key{i}" for i in range(6)])) == {"key0", "key3", "key4", "key5"}
+
+
+def test_result_cache_merge(tmp_path):
+    with ResultCache(str(tmp_path / "shard0.sqlite")) as shard:
+        shard.add("a", {"x": 1})
+        shard.add("b", {"x": 2})
+    with ResultCache(str(tmp_path / "main.sqlite")) as cache:
+        cache.add("b", {"x": 2})
+        assert cache.merge(str(tmp_path / "shard0.sqlite")) == 1
+        assert cache.merge(str(tmp_path / "shard0.sqlite")) == 0
+        assert cache.get_many(["a", "b"]) == {"a": {"x": 1}, "b": {"x": 2}}
+
+
+# --- whole sweeps through batch_custom.run on a tiny grid
+
+@pytest.fixture(scope="module")
+def batch_custom(tmp_path_factory):
+    # batch_custom opens its log file in the working directory on import
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("logs"))
+    try:
+        import batch_custom
+    finally:
+        os.chdir(cwd)
+    return batch_custom
+
+
+@pytest.fixture
+def sweep(batch_custom, tmp_path, monkeypatch):
+    # a 4-point grid of short runs; workers are forked so they see the
+    # patched grid instead of re-importing batch_custom
+    monkeypatch.chdir(tmp_path)
+    for name, value in {"WIDTH": 12, "HEIGHT": 12, "ALPHA": [0.1, 0.4], "RATIOS": [1, 4],
+                        "DECAY": [0.8], "AVERSION": [0.1], "ITERATIONS": 3,
+                        "MAX_STEPS": 8}.items():
+        monkeypatch.setattr(batch_custom, name, value)
+    monkeypatch.setattr(batch_custom, "mp", argparse.Namespace(
+        get_context=lambda method: multiprocessing.get_context("fork")))
+
+    def run(**options):
+        args = argparse.Namespace(shard_index=0, shard_count=1, processes=2, format="csv",
+                                  trajectories=False, profile=False, batched=False,
+                                  shared_memory=False, grid_order=False,
+                                  cache="cache.sqlite", no_cache=True)
+        for name, value in options.items():
+            setattr(args, name, value)
+        batch_custom.run(args)
+        engine = batch_custom.sweep_engine(args)
+        total = len(batch_custom.build_tasks(engine))
+        return batch_custom.output_file(total, engine)
+    return run
+
+
+def read_sorted(path):
+    return pd.read_csv(path).sort_values("task_key", ignore_index=True)
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_shared_memory_results_match(sweep, batched):
+    path = sweep(batched=batched)
+    plain = read_sorted(path)
+    os.remove(path)
+    shared = read_sorted(sweep(batched=batched, shared_memory=True))
+    assert len(plain) == 12
+    pd.testing.assert_frame_equal(shared, plain)
+
+
+def test_resume_skips_done_tasks(sweep, caplog):
+    path = sweep()
+    complete = read_sorted(path)
+    # keep the first 5 recorded runs, as if the job had been killed
+    with open(path) as f:
+        lines = f.readlines()
+    with open(path, "w") as f:
+        f.writelines(lines[:6])
+
+    caplog.set_level(logging.INFO, logger="batch_custom")
+    sweep()
+    assert "5 tasks already done, 7 remaining" in caplog.text
+    pd.testing.assert_frame_equal(read_sorted(path), complete)
+
+
+def test_resume_with_other_columns_runs_nothing(sweep):
+    path = sweep()
+    with open(path) as f:
+        before = f.read()
+    with pytest.raises(ValueError, match="this run writes"):
+        sweep(profile=True)
+    with open(path) as f:
+        assert f.read() == before
+
+
+def test_cached_runs_match_simulated_runs(sweep):
+    path = sweep(no_cache=False)
+    simulated = read_sorted(path)
+    os.remove(path)
+    pd.testing.assert_frame_equal(read_sorted(sweep(no_cache=False)), simulated)